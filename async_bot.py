@@ -0,0 +1,555 @@
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+import config
+import charts
+import db
+import metrics
+import migrations
+import sessions
+import tracker
+import transfer
+import views
+import webhook
+from outbound import AsyncOutbox
+from router import Router
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Асинхронный движок (AsyncTeleBot)
+# ==========================
+# Те же экраны и операции, что и в threaded_bot.py, но обработчики — корутины, таймеры —
+# задачи asyncio, а блокирующая работа с SQLite уходит в отдельный пул потоков БД.
+# Запуск: python bot.py --engine asyncio (или ENGINE = "asyncio" в config).
+
+router = Router()
+if getattr(config, "API_URL", None):
+    asyncio_helper.API_URL = config.API_URL
+if getattr(config, "FILE_URL", None):
+    asyncio_helper.FILE_URL = config.FILE_URL
+bot = AsyncTeleBot(config.TOKEN)
+metrics.instrument_api(asyncio_helper, "_process_request", 1)
+outbox = AsyncOutbox(
+    bot,
+    global_rate=getattr(config, "OUTBOX_GLOBAL_RATE", 30),
+    chat_rate=getattr(config, "OUTBOX_CHAT_RATE", 1),
+    chat_burst=getattr(config, "OUTBOX_CHAT_BURST", 3)
+)
+db_executor = ThreadPoolExecutor(max_workers=getattr(config, "DB_WORKERS", 4), thread_name_prefix="db")
+# Выгрузка и импорт занимают поток надолго — у них свой пул, чтобы не задерживать запросы обработчиков
+transfer_executor = ThreadPoolExecutor(max_workers=getattr(config, "TRANSFER_WORKERS", 1), thread_name_prefix="transfer")
+chart_renderer = charts.ChartRenderer(
+    workers=getattr(config, "CHART_WORKERS", 1),
+    max_pending=getattr(config, "CHART_QUEUE_SIZE", 8),
+    timeout=getattr(config, "CHART_TIMEOUT", 20)
+)
+
+TIMER_INTERVAL = 10
+# Состояние чатов с отложенной записью в chat_sessions (см. sessions.py)
+main_messages = sessions.WriteBehindMap("main_message_id")   # chat_id -> message_id основного сообщения
+user_states = sessions.json_map("user_state")                 # chat_id -> dict с состоянием ввода
+timers = {}               # chat_id -> asyncio.Task обновления таймера
+
+
+async def run_in(executor, func, *args):
+    """Выполняет синхронную функцию в пуле потоков executor.
+
+    Контекст (metrics.current_handler) копируется в поток, чтобы запросы засчитывались обработчику.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+
+async def run_db(func, *args):
+    """Выполняет синхронную операцию с базой в пуле потоков БД."""
+    return await run_in(db_executor, func, *args)
+
+
+# ==========================
+# Отправка сообщений
+# ==========================
+# Обработчики не ждут лимитов Telegram (как в threaded_bot): новое основное сообщение
+# отправляется из очереди outbox, а тексты, пришедшие до его отправки, правят его следом.
+sending_main = {}         # chat_id -> последний текст для отправляемого сообщения
+
+
+async def send_text(chat_id, text, reply_markup=None):
+    if chat_id in main_messages:
+        outbox.edit(chat_id, main_messages[chat_id], text, reply_markup=reply_markup)
+    elif chat_id in sending_main:
+        sending_main[chat_id] = (text, reply_markup)
+    else:
+        sending_main[chat_id] = None
+        outbox.send(chat_id, bot.send_message, chat_id, text, reply_markup=reply_markup,
+                    callback=lambda msg: main_message_sent(chat_id, msg))
+
+
+def main_message_sent(chat_id, msg):
+    """Новое основное сообщение отправлено (msg is None — не отправлено)."""
+    latest = sending_main.pop(chat_id, None)
+    if msg is not None:
+        main_messages[chat_id] = msg.message_id
+    if latest is None:
+        return
+    if msg is None:
+        asyncio.get_running_loop().create_task(send_text(chat_id, *latest))
+    else:
+        outbox.edit(chat_id, msg.message_id, *latest)
+
+
+def drop_main_message(chat_id):
+    message_id = main_messages.pop(chat_id, None)
+    if message_id is not None:
+        outbox.forget(chat_id, message_id)
+
+
+async def replace_lost_message(chat_id, message_id, text, reply_markup):
+    """Пользователь удалил сообщение (или оно устарело): текст правки уходит новым сообщением."""
+    if main_messages.get(chat_id) == message_id:
+        main_messages.pop(chat_id, None)
+    await send_text(chat_id, text, reply_markup=reply_markup)
+
+
+outbox.on_lost = replace_lost_message
+
+
+async def send_main_menu(chat_id):
+    await send_text(chat_id, views.MAIN_MENU_TEXT, views.get_main_keyboard())
+    logger.info("Sent main menu to chat_id %s", chat_id)
+
+
+async def answer(call, text=None):
+    try:
+        await bot.answer_callback_query(call.id, text)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+
+
+async def delete_message(chat_id, message_id):
+    # Ошибки удаления пишет в лог сам outbox
+    outbox.send(chat_id, bot.delete_message, chat_id, message_id)
+
+
+async def send_chart(chat_id, png):
+    try:
+        await outbox.call(chat_id, bot.send_photo, chat_id, photo=png)
+    except Exception as e:
+        logger.exception("Error sending chart: %s", e)
+
+
+# ==========================
+# Таймеры (задачи asyncio)
+# ==========================
+@metrics.timed
+async def timer_tick(chat_id, task_id):
+    """Одно обновление сообщения таймера. Возвращает False, если таймер больше не нужен."""
+    info = await run_db(tracker.get_current_task_info, chat_id)
+    # Если задача изменилась или удалена, таймер больше не обновляем
+    if not info or info[0] != task_id:
+        return False
+    if chat_id in main_messages:
+        outbox.edit(chat_id, main_messages[chat_id], views.timer_text(*info[1:]))
+    return True
+
+
+async def timer_loop(chat_id, task_id, delay=TIMER_INTERVAL):
+    try:
+        while True:
+            await asyncio.sleep(delay)
+            delay = TIMER_INTERVAL
+            if not await timer_tick(chat_id, task_id):
+                break
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.exception("Error in timer for chat_id %s: %s", chat_id, e)
+    finally:
+        if timers.get(chat_id) is asyncio.current_task():
+            del timers[chat_id]
+    logger.info("Timer for chat_id %s ended", chat_id)
+
+
+def cancel_timer(chat_id):
+    task = timers.pop(chat_id, None)
+    if task is not None:
+        task.cancel()
+
+
+async def start_timer(chat_id, task_id):
+    cancel_timer(chat_id)
+    await run_db(tracker.switch_task, chat_id, task_id)
+    timers[chat_id] = asyncio.create_task(timer_loop(chat_id, task_id))
+    logger.info("Started timer for chat_id %s, task_id %s", chat_id, task_id)
+
+
+async def resume_timers():
+    """Возобновляет таймеры запущенных задач после перезапуска, разнося первые обновления во времени."""
+    rows = await run_db(tracker.load_current_tasks)
+    spread = getattr(config, "TIMER_RESUME_SPREAD", TIMER_INTERVAL)
+    for index, (chat_id, task_id) in enumerate(rows):
+        timers[chat_id] = asyncio.create_task(timer_loop(chat_id, task_id, spread * (index + 1) / len(rows)))
+    logger.info("Resumed %s timers over %s s", len(rows), spread)
+
+
+async def stop_timer(chat_id):
+    cancel_timer(chat_id)
+    await run_db(tracker.stop_task, chat_id)
+    logger.info("Stopped timer for chat_id %s", chat_id)
+
+
+# ==========================
+# Экраны
+# ==========================
+@metrics.timed
+async def show_categories(chat_id, after=0):
+    text, markup = await run_db(views.categories_view, chat_id, after)
+    await send_text(chat_id, text, reply_markup=markup)
+
+
+@metrics.timed
+async def show_current_task(chat_id):
+    text, markup = await run_db(views.current_task_view, chat_id)
+    await send_text(chat_id, text, reply_markup=markup)
+
+
+@metrics.timed
+async def show_statistics(chat_id):
+    text, markup, data = await run_db(views.statistics_view, chat_id)
+    await send_text(chat_id, text, reply_markup=markup)
+    # Текст отвечаем сразу, график догонит его, когда будет готов
+    loop = asyncio.get_running_loop()
+    deliver = lambda png: asyncio.run_coroutine_threadsafe(send_chart(chat_id, png), loop)
+    if charts.has_chart(data) and not chart_renderer.submit(data, deliver):
+        logger.warning("Chart for chat_id %s skipped: render queue is full", chat_id)
+
+
+@metrics.timed
+async def show_range_statistics(chat_id, range_text):
+    text, markup = await run_db(views.range_statistics_view, chat_id, range_text)
+    await send_text(chat_id, text, reply_markup=markup)
+
+
+# ==========================
+# Обработчики
+# ==========================
+@bot.message_handler(commands=['start'])
+@metrics.timed
+async def handle_start(message):
+    chat_id = message.chat.id
+    # /start всегда присылает новое меню, даже если прежнее сообщение ещё числится основным
+    drop_main_message(chat_id)
+    await send_main_menu(chat_id)
+    await delete_message(chat_id, message.message_id)
+
+
+@bot.message_handler(commands=['stats'])
+@metrics.timed
+async def handle_stats_command(message):
+    chat_id = message.chat.id
+    await show_range_statistics(chat_id, views.command_argument(message, "today"))
+    await delete_message(chat_id, message.message_id)
+
+
+@router.callback("menu")
+async def handle_menu(call, section):
+    chat_id = call.message.chat.id
+    if section == "categories":
+        await show_categories(chat_id)
+    elif section == "current_task":
+        await show_current_task(chat_id)
+    elif section == "statistics":
+        await show_statistics(chat_id)
+    await answer(call)
+
+
+@router.callback("cat_page")
+async def handle_categories_page(call, after):
+    await show_categories(call.message.chat.id, after)
+    await answer(call)
+
+
+@router.callback("add_category")
+async def handle_add_category(call):
+    chat_id = call.message.chat.id
+    await send_text(chat_id, "Введите название категории:")
+    user_states[chat_id] = {"state": "adding_category"}
+    await answer(call)
+
+
+@router.state("adding_category")
+async def process_add_category(message):
+    chat_id = message.chat.id
+    # Состояние снимаем до первого await: иначе оно может затереть состояние,
+    # выставленное следующим нажатием, пока этот обработчик ждёт отправки
+    user_states.pop(chat_id, None)
+    await run_db(tracker.add_category, chat_id, message.text.strip())
+    await send_main_menu(chat_id)
+    await delete_message(chat_id, message.message_id)
+
+
+@router.callback("manage_cat")
+async def handle_manage_category(call, cat_id):
+    chat_id = call.message.chat.id
+    text, markup = await run_db(views.category_view, chat_id, cat_id)
+    outbox.edit(chat_id, call.message.message_id, text, reply_markup=markup)
+    await answer(call)
+
+
+@router.callback("edit_cat")
+async def handle_edit_category(call, cat_id):
+    chat_id = call.message.chat.id
+    outbox.edit(chat_id, call.message.message_id, "Введите новое название категории:")
+    user_states[chat_id] = {"state": "editing_category", "category_id": cat_id}
+    await answer(call)
+
+
+@router.state("editing_category")
+async def process_edit_category(message):
+    chat_id = message.chat.id
+    cat_id = user_states.pop(chat_id)["category_id"]
+    if await run_db(tracker.rename_category, chat_id, cat_id, message.text.strip()):
+        await send_main_menu(chat_id)
+    else:
+        await send_text(chat_id, views.CATEGORY_NOT_FOUND_TEXT, views.get_back_keyboard())
+    await delete_message(chat_id, message.message_id)
+
+
+@router.callback("delete_cat")
+async def handle_delete_category(call, cat_id):
+    chat_id = call.message.chat.id
+    if not await run_db(tracker.delete_category, chat_id, cat_id):
+        await answer(call, "Категория не найдена")
+        return
+    await send_main_menu(chat_id)
+    await answer(call, "Категория удалена")
+
+
+@router.callback("view_tasks")
+async def handle_view_tasks(call, cat_id, after=0):
+    chat_id = call.message.chat.id
+    text, markup = await run_db(views.tasks_view, chat_id, cat_id, after)
+    await send_text(chat_id, text, reply_markup=markup)
+    await answer(call)
+
+
+@router.callback("select_task")
+async def handle_select_task(call, task_id):
+    chat_id = call.message.chat.id
+    if not await run_db(tracker.owns_task, chat_id, task_id):
+        await answer(call, "Задача не найдена")
+        return
+    await start_timer(chat_id, task_id)
+    text, markup = views.task_selected_view(task_id)
+    await send_text(chat_id, text, reply_markup=markup)
+    await answer(call)
+
+
+@bot.message_handler(commands=['switch'])
+@metrics.timed
+async def handle_switch_command(message):
+    chat_id = message.chat.id
+    task_id = await run_db(views.switch_target, message)
+    if task_id is None:
+        await send_text(chat_id, views.SWITCH_USAGE_TEXT, reply_markup=views.get_back_keyboard())
+    else:
+        await start_timer(chat_id, task_id)
+        text, markup = views.task_selected_view(task_id)
+        await send_text(chat_id, text, reply_markup=markup)
+    await delete_message(chat_id, message.message_id)
+
+
+# Команда /export [csv|jsonl] [entries|totals]
+@bot.message_handler(commands=['export'])
+@metrics.timed
+async def handle_export_command(message):
+    chat_id = message.chat.id
+    await delete_message(chat_id, message.message_id)
+    options = transfer.parse_export_args(views.command_argument(message))
+    if options is None:
+        await send_text(chat_id, views.EXPORT_USAGE_TEXT, reply_markup=views.get_back_keyboard())
+        return
+    await send_text(chat_id, views.EXPORT_STARTED_TEXT, reply_markup=views.get_back_keyboard())
+    try:
+        file, name, rows = await run_in(transfer_executor, transfer.write_export, chat_id, *options)
+    except Exception as e:
+        logger.exception("Error exporting data for chat_id %s: %s", chat_id, e)
+        await send_text(chat_id, views.EXPORT_FAILED_TEXT, reply_markup=views.get_back_keyboard())
+        return
+    with file:
+        size = file.seek(0, io.SEEK_END)
+        file.seek(0)
+        if size > transfer.MAX_DOCUMENT_SIZE:
+            await send_text(chat_id, views.EXPORT_TOO_LARGE_TEXT, reply_markup=views.get_back_keyboard())
+            return
+        try:
+            await outbox.call(chat_id, bot.send_document, chat_id, file,
+                              visible_file_name=name, caption=views.export_caption(rows))
+        except Exception as e:
+            logger.exception("Error sending export: %s", e)
+
+
+# Команда /import: следующий присланный документ будет импортирован
+@bot.message_handler(commands=['import'])
+@metrics.timed
+async def handle_import_command(message):
+    chat_id = message.chat.id
+    user_states[chat_id] = {"state": "importing"}
+    await send_text(chat_id, views.IMPORT_PROMPT_TEXT, reply_markup=views.get_back_keyboard())
+    await delete_message(chat_id, message.message_id)
+
+
+# Документ после /import или с подписью /import
+@bot.message_handler(content_types=['document'],
+                     func=lambda message: (message.caption or "").startswith("/import")
+                     or user_states.get(message.chat.id, {}).get("state") == "importing")
+@metrics.timed
+async def handle_import_document(message):
+    chat_id = message.chat.id
+    user_states.pop(chat_id, None)
+    document = message.document
+    await delete_message(chat_id, message.message_id)
+    if (document.file_size or 0) > transfer.MAX_DOWNLOAD_SIZE:
+        await send_text(chat_id, views.IMPORT_TOO_LARGE_TEXT, reply_markup=views.get_back_keyboard())
+        return
+    await send_text(chat_id, views.IMPORT_STARTED_TEXT)
+    try:
+        file_info = await bot.get_file(document.file_id)
+        data = await bot.download_file(file_info.file_path)
+        summary = await run_in(transfer_executor, transfer.import_file, chat_id, io.BytesIO(data), document.file_name)
+    except ValueError as e:
+        text = f"{views.IMPORT_FAILED_TEXT}: {e}."
+    except Exception as e:
+        logger.exception("Error importing data for chat_id %s: %s", chat_id, e)
+        text = f"{views.IMPORT_FAILED_TEXT}."
+    else:
+        text = views.import_report_text(summary)
+    await send_text(chat_id, text, reply_markup=views.get_back_keyboard())
+
+
+@router.callback("add_task")
+async def handle_add_task(call, cat_id):
+    chat_id = call.message.chat.id
+    await send_text(chat_id, "Введите название задачи:")
+    user_states[chat_id] = {"state": "adding_task", "category_id": cat_id}
+    await answer(call)
+
+
+@router.state("adding_task")
+async def process_add_task(message):
+    chat_id = message.chat.id
+    cat_id = user_states.pop(chat_id).get("category_id")
+    if await run_db(tracker.add_task, chat_id, cat_id, message.text.strip()):
+        await send_main_menu(chat_id)
+    else:
+        await send_text(chat_id, views.CATEGORY_NOT_FOUND_TEXT, views.get_back_keyboard())
+    await delete_message(chat_id, message.message_id)
+
+
+@router.callback("stats")
+async def handle_stats_range(call, period):
+    await show_range_statistics(call.message.chat.id, period)
+    await answer(call)
+
+
+@router.callback("back_main")
+async def handle_back(call):
+    await send_main_menu(call.message.chat.id)
+    await answer(call)
+
+
+@bot.callback_query_handler(func=lambda call: True)
+async def dispatch_callback(call):
+    handler, args = router.match_callback(call.data)
+    if handler is None:
+        await answer(call)
+        return
+    await handler(call, *args)
+
+
+@bot.message_handler(func=lambda message: router.has_state(user_states.get(message.chat.id, {}).get("state")))
+async def dispatch_state_message(message):
+    await router.match_state(user_states[message.chat.id]["state"])(message)
+
+
+def runtime_stats():
+    """Сводка внутренних счётчиков (как threaded_bot.runtime_stats)."""
+    return {
+        "db": db.stats(),
+        "metadata_cache": tracker.metadata_cache.stats(),
+        "outbox": outbox.stats(),
+        "timers": len(timers),
+        "charts": chart_renderer.stats(),
+    }
+
+
+def register_metrics():
+    """Метрики очередей и счётчики компонентов на /metrics (как threaded_bot.register_metrics)."""
+    metrics.REGISTRY.gauge("bot_active_timers", "Timers currently scheduled", lambda: len(timers))
+    metrics.REGISTRY.gauge("bot_outbox_queue_depth", "Outgoing API calls waiting for a rate-limit slot",
+                           lambda: outbox.stats()["queue_depth"])
+    metrics.REGISTRY.gauge("bot_chart_pending", "Chart renders in flight", lambda: chart_renderer.pending)
+    metrics.register_stats(runtime_stats)
+    port = getattr(config, "METRICS_PORT", metrics.METRICS_PORT)
+    if port is not None:
+        metrics.start_server(getattr(config, "METRICS_HOST", metrics.METRICS_HOST), port)
+
+
+def shutdown(signum=None, frame=None):
+    """Остановка по SIGTERM: сохраняет состояние чатов и пишет итоговую статистику в лог."""
+    main_messages.flush()
+    user_states.flush()
+    logger.info("Final stats: %s", json.dumps(runtime_stats()))
+    logging.shutdown()
+    os._exit(0)
+
+
+async def run(mode="polling"):
+    loop = asyncio.get_running_loop()
+    await resume_timers()
+    prewarm_delay = getattr(config, "CHART_PREWARM_DELAY", 5)
+    if prewarm_delay is not None:
+        loop.call_later(prewarm_delay, lambda: loop.run_in_executor(None, chart_renderer.prewarm))
+    if mode == "webhook":
+        await run_webhook(loop)
+        return
+    # Пока зарегистрирован webhook (например, после --mode webhook), getUpdates отвечает 409
+    try:
+        await bot.delete_webhook()
+    except Exception as e:
+        logger.exception("Error deleting webhook: %s", e)
+    logger.info("Starting async bot polling...")
+    await bot.polling(non_stop=True)
+
+
+async def run_webhook(loop):
+    """HTTP-сервер webhook работает в своём потоке и передаёт обновления в цикл событий."""
+    def on_update(update):
+        asyncio.run_coroutine_threadsafe(bot.process_new_updates([types.Update.de_json(update)]), loop)
+
+    server = webhook.create_server(on_update)
+    kwargs = webhook.registration()
+    if kwargs is not None:
+        await bot.set_webhook(**kwargs)
+        logger.info("Webhook registered at %s", kwargs["url"])
+    logger.info("Starting async webhook server on %s:%s", *server.server_address[:2])
+    await loop.run_in_executor(None, server.serve_forever)
+
+
+def main(mode="polling"):
+    signal.signal(signal.SIGTERM, shutdown)
+    version = migrations.migrate(db.get_connection())
+    logger.info("Database initialized (schema version %s).", version)
+    logger.info("Loaded %s main messages and %s input states", main_messages.load(), user_states.load())
+    sessions.start_flusher((main_messages, user_states), getattr(config, "SESSION_FLUSH_INTERVAL", sessions.FLUSH_INTERVAL))
+    register_metrics()
+    asyncio.run(run(mode))
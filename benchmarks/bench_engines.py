@@ -0,0 +1,79 @@
+"""Сравнение потокового и asyncio-движков: обновлений в секунду и задержка p50/p99.
+
+Каждый движок запускается отдельным процессом (python bot.py --engine ...) с временным
+config.py, направляющим Bot API на локальную заглушку (fake_api). Заглушка раздаёт через getUpdates
+пачку нажатий "Категории" от разных пользователей; задержка обновления — время от выдачи
+в getUpdates до answerCallbackQuery.
+
+Запуск: python benchmarks/bench_engines.py [--updates 2000] [--users 200]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import FakeBotApi, bot_config, callback_update, percentile, start_bot
+
+
+def seed(db_path, categories, chat_ids):
+    """По categories категорий у каждого чата из chat_ids."""
+    import sqlite3
+    import migrations
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    migrations.migrate(conn)
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO categories (name, chat_id) VALUES (?, ?)",
+                     [(f"cat {i}", chat_id) for chat_id in chat_ids for i in range(categories)])
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def run_engine(engine, args):
+    server = FakeBotApi().start()
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(os.path.join(tmp, "tasks.db"), args.categories, range(10_000, 10_000 + args.users))
+        bot_config(tmp, server, OUTBOX_GLOBAL_RATE=10 ** 9, OUTBOX_CHAT_RATE=10 ** 9, OUTBOX_CHAT_BURST=10 ** 9)
+        proc = start_bot(tmp, "--engine", engine)
+        try:
+            if not server.polled.wait(30):
+                sys.exit(f"{engine}: bot did not start polling")
+            updates = [callback_update(i + 1, 10_000 + i % args.users, "menu:categories") for i in range(args.updates)]
+            server.push(updates)
+            deadline = time.perf_counter() + args.timeout
+            while len(server.answered) < args.updates and time.perf_counter() < deadline:
+                time.sleep(0.05)
+        finally:
+            proc.terminate()
+            proc.wait()
+            server.shutdown()
+    latencies = [server.answered[k] - server.handed_out[k] for k in server.answered if k in server.handed_out]
+    if not latencies:
+        return {"engine": engine, "answered": 0}
+    elapsed = max(server.answered.values()) - min(server.handed_out.values())
+    return {
+        "engine": engine,
+        "answered": len(latencies),
+        "updates_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--engines", nargs="+", default=["threaded", "asyncio"])
+    args = parser.parse_args()
+    for engine in args.engines:
+        print(json.dumps(run_engine(engine, args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Изоляция чатов в полосе: занятый чат не должен задерживать ответ другому чату.
+
+Бот запускается на заглушке Bot API с лимитом OUTBOX_CHAT_RATE=1 сообщение в секунду
+на чат. Занятый чат присылает --burst команд /start (новое меню и удаление каждой команды —
+вызовы сверх лимита чата), сразу за ними другой чат той же полосы (chat_id отличается
+на число полос) нажимает кнопку меню. Отчёт: через сколько бот ответил на это нажатие
+и когда удалена последняя команда занятого чата. Ответ тихому чату не должен ждать
+лимитов занятого — задержка порядка миллисекунд, а не секунд.
+
+Запуск: python benchmarks/bench_isolation.py [--burst 8] [--engine threaded|asyncio]
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+from fake_api import FakeBotApi, bot_config, callback_update, message_update, start_bot
+
+BUSY_CHAT = 100_000
+
+
+def run(args):
+    api = FakeBotApi().start()
+    with tempfile.TemporaryDirectory() as tmp:
+        bot_config(tmp, api, OUTBOX_CHAT_RATE=1, OUTBOX_CHAT_BURST=3, UPDATE_WORKERS=args.lanes,
+                   METRICS_PORT=None)
+        proc = start_bot(tmp, "--engine", args.engine)
+        try:
+            if not api.polled.wait(30):
+                sys.exit("bot did not start polling")
+            quiet_chat = BUSY_CHAT + args.lanes      # та же полоса: hash(chat_id) % lanes
+            updates = [message_update(i + 1, BUSY_CHAT, "/start") for i in range(args.burst)]
+            click = callback_update(args.burst + 1, quiet_chat, "menu:categories")
+            started = time.perf_counter()
+            api.push(updates + [click])
+            answered = api.wait_answer(click["callback_query"]["id"], args.timeout)
+            # Удаление команд идёт последним в очереди занятого чата
+            deadline = time.monotonic() + args.timeout
+            while api.calls["deleteMessage"] < args.burst:
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+            busy_done = time.perf_counter()
+        finally:
+            proc.terminate()
+            proc.wait()
+            api.shutdown()
+    return {
+        "engine": args.engine,
+        "burst": args.burst,
+        "lanes": args.lanes,
+        "quiet_chat_answer_ms": round((answered - started) * 1000, 1) if answered else None,
+        "busy_chat_done_s": round(busy_done - started, 2),
+        "api_calls": dict(api.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=8, help="команд /start от занятого чата")
+    parser.add_argument("--lanes", type=int, default=4, help="UPDATE_WORKERS бота")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    print(json.dumps(run(args), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
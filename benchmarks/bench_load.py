@@ -0,0 +1,264 @@
+"""Сквозная нагрузка на bot.py через заглушку Bot API (fake_api).
+
+N пользователей параллельно проходят сценарий
+"Категории" -> задачи категории -> выбор задачи -> "Статистика"
+(menu:categories -> view_tasks:<id> -> select_task:<id> -> menu:statistics), каждый раз
+дожидаясь ответа бота на нажатие. Отчёт: пропускная способность, задержка обработчика
+(от выдачи боту до answerCallbackQuery) и полная задержка нажатия p50/p99, пиковые число
+потоков и RSS процесса бота, ожидания блокировки SQLite (из итоговой статистики бота),
+вызовы Bot API по методам. Результат сохраняется в JSON (--output) и может быть
+сравнён с прошлым прогоном (--compare).
+
+Запуск: python benchmarks/bench_load.py [--users 50] [--rounds 5] [--engine threaded]
+        [--mode polling|webhook] [--output run.json] [--compare old.json]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from fake_api import ROOT, FakeBotApi, bot_config, callback_update, final_stats, percentile, start_bot
+
+sys.path.insert(0, ROOT)
+
+import migrations
+
+SECRET = "load-secret"
+WEBHOOK_PATH = "/telegram"
+
+
+def seed(db_path, chat_ids, categories, tasks_per_category):
+    """У каждого чата categories категорий по tasks_per_category задач.
+
+    Возвращает {chat_id: {категория: [задачи]}}.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    migrations.migrate(conn)
+    conn.execute("BEGIN")
+    tasks = {}
+    cat_id = itertools.count(1)
+    task_id = itertools.count(1)
+    for chat_id in chat_ids:
+        owned = tasks[chat_id] = {next(cat_id): [] for _ in range(categories)}
+        conn.executemany("INSERT INTO categories (id, name, chat_id) VALUES (?, ?, ?)",
+                         ((i, f"cat {i}", chat_id) for i in owned))
+        for i in owned:
+            owned[i] = [next(task_id) for _ in range(tasks_per_category)]
+            conn.executemany("INSERT INTO tasks (id, category_id, name, chat_id) VALUES (?, ?, ?, ?)",
+                             ((t, i, f"task {t}", chat_id) for t in owned[i]))
+    conn.execute("COMMIT")
+    conn.close()
+    return tasks
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ProcessSampler(threading.Thread):
+    """Раз в interval секунд читает число потоков и RSS процесса из /proc (только Linux)."""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.path = f"/proc/{pid}/status"
+        self.interval = interval
+        self.threads_peak = None
+        self.rss_peak_kb = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with open(self.path) as f:
+                    fields = dict(line.split(":", 1) for line in f if ":" in line)
+            except OSError:
+                return
+            threads = int(fields["Threads"])
+            rss_kb = int(fields["VmRSS"].split()[0])
+            self.threads_peak = max(self.threads_peak or 0, threads)
+            self.rss_peak_kb = max(self.rss_peak_kb or 0, rss_kb)
+
+
+class Deliverer:
+    """Передаёт нажатия боту: через очередь getUpdates или POST на webhook."""
+
+    def __init__(self, api, webhook_port=None):
+        self.api = api
+        self.webhook_port = webhook_port
+        self._local = threading.local()
+
+    def send(self, update):
+        if self.webhook_port is None:
+            self.api.push([update])
+            return
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.webhook_port, timeout=30)
+        self.api.mark_sent(update)
+        conn.request("POST", WEBHOOK_PATH, json.dumps(update),
+                     {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": SECRET})
+        conn.getresponse().read()
+
+
+def simulate_user(chat_id, tasks, args, deliverer, update_ids, results):
+    rng = random.Random(chat_id)
+    for _ in range(args.rounds):
+        cat_id = rng.choice(list(tasks))
+        for data in ("menu:categories", f"view_tasks:{cat_id}",
+                     f"select_task:{rng.choice(tasks[cat_id])}", "menu:statistics"):
+            update = callback_update(next(update_ids), chat_id, data)
+            callback_id = update["callback_query"]["id"]
+            sent = time.perf_counter()
+            deliverer.send(update)
+            answered = deliverer.api.wait_answer(callback_id, args.click_timeout)
+            if answered is None:
+                results.append((data, None, None))
+                return
+            handed_out = deliverer.api.handed_out.get(callback_id, sent)
+            results.append((data.split(":")[0], answered - handed_out, answered - sent))
+            if args.think_ms:
+                time.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+
+
+def latency_summary(values):
+    if not values:
+        return None
+    return {"p50_ms": round(percentile(values, 0.5) * 1000, 2), "p99_ms": round(percentile(values, 0.99) * 1000, 2)}
+
+
+def run(args):
+    api = FakeBotApi(latency=args.api_latency_ms / 1000).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        chat_ids = [100_000 + i for i in range(args.users)]
+        tasks = seed(os.path.join(tmp, "tasks.db"), chat_ids, args.categories, args.tasks_per_category)
+        settings = {}
+        if args.unlimited_outbox:
+            settings.update(OUTBOX_GLOBAL_RATE=10 ** 9, OUTBOX_CHAT_RATE=10 ** 9, OUTBOX_CHAT_BURST=10 ** 9)
+        webhook_port = None
+        if args.mode == "webhook":
+            webhook_port = free_port()
+            settings.update(WEBHOOK_HOST="127.0.0.1", WEBHOOK_PORT=webhook_port,
+                            WEBHOOK_PATH=WEBHOOK_PATH, WEBHOOK_SECRET=SECRET)
+        bot_config(tmp, api, **settings)
+        proc = start_bot(tmp, "--engine", args.engine, "--mode", args.mode)
+        sampler = ProcessSampler(proc.pid)
+        sampler.start()
+        try:
+            if args.mode == "polling" and not api.polled.wait(30):
+                sys.exit("bot did not start polling")
+            if webhook_port is not None:
+                deadline = time.monotonic() + 30
+                while True:
+                    try:
+                        socket.create_connection(("127.0.0.1", webhook_port), timeout=1).close()
+                        break
+                    except OSError:
+                        if time.monotonic() > deadline:
+                            sys.exit("webhook server did not start")
+                        time.sleep(0.05)
+            deliverer = Deliverer(api, webhook_port)
+            update_ids = itertools.count(1)
+            results = []
+            users = [threading.Thread(target=simulate_user,
+                                      args=(chat_id, tasks[chat_id], args, deliverer, update_ids, results))
+                     for chat_id in chat_ids]
+            started = time.perf_counter()
+            for thread in users:
+                thread.start()
+            for thread in users:
+                thread.join()
+            duration = time.perf_counter() - started
+        finally:
+            sampler.stopped.set()
+            proc.terminate()
+            proc.wait()
+            api.shutdown()
+        stats = final_stats(tmp)
+
+    answered = [r for r in results if r[1] is not None]
+    report = {
+        "engine": args.engine,
+        "mode": args.mode,
+        "users": args.users,
+        "rounds": args.rounds,
+        "api_latency_ms": args.api_latency_ms,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "clicks": len(results),
+        "answered": len(answered),
+        "timed_out": len(results) - len(answered),
+        "duration_s": round(duration, 3),
+        "throughput_clicks_per_s": round(len(answered) / duration, 1) if duration else None,
+        "handler_latency": latency_summary([r[1] for r in answered]),
+        "click_latency": latency_summary([r[2] for r in answered]),
+        "by_action": {action: latency_summary([r[1] for r in answered if r[0] == action])
+                      for action in sorted({r[0] for r in answered})},
+        "threads_peak": sampler.threads_peak,
+        "rss_peak_mb": round(sampler.rss_peak_kb / 1024, 1) if sampler.rss_peak_kb else None,
+        "sqlite": stats["db"] if stats else None,
+        "api_calls": dict(api.calls),
+        "api_errors": dict(api.errors),
+        "bot_stats": stats,
+    }
+    return report
+
+
+def flatten(data, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1} для числовых полей."""
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+
+def compare(old, new):
+    old_values = flatten(old)
+    for name, value in flatten(new).items():
+        if name in old_values and old_values[name] != value:
+            before = old_values[name]
+            change = f" ({(value - before) / before * 100:+.1f}%)" if before else ""
+            print(f"{name}: {before} -> {value}{change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=5, help="проходов сценария на пользователя")
+    parser.add_argument("--engine", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--categories", type=int, default=20, help="категорий у каждого пользователя")
+    parser.add_argument("--tasks-per-category", type=int, default=5)
+    parser.add_argument("--think-ms", type=float, default=0, help="средняя пауза пользователя между нажатиями")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="задержка каждого ответа заглушки")
+    parser.add_argument("--click-timeout", type=float, default=60)
+    parser.add_argument("--unlimited-outbox", action="store_true",
+                        help="снять лимиты исходящих сообщений Telegram (мерить только обработку)")
+    parser.add_argument("--output", help="сохранить отчёт в JSON")
+    parser.add_argument("--compare", help="сравнить с отчётом прошлого прогона")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
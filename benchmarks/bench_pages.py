@@ -0,0 +1,91 @@
+"""Стоимость экрана категорий: прежняя выборка всех категорий против keyset-страницы чата.
+
+База заполняется chats чатами по categories категорий, у одного «тяжёлого» чата их
+heavy. Для страницы замеряются первая, средняя и последняя страницы тяжёлого чата
+и первая страница обычного — время не должно зависеть ни от размера таблицы, ни от
+номера страницы.
+
+Запуск: python benchmarks/bench_pages.py [--chats 10000] [--categories 100] [--heavy 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import stub_config
+
+stub_config()
+
+import db
+import migrations
+import tracker
+
+HEAVY_CHAT = 0
+
+
+def populate(args):
+    with db.transaction() as cursor:
+        cursor.executemany("INSERT INTO categories (name, chat_id) VALUES (?, ?)",
+                           ((f"cat {i}", chat_id) for chat_id in range(1, args.chats + 1)
+                            for i in range(args.categories)))
+        cursor.executemany("INSERT INTO categories (name, chat_id) VALUES (?, ?)",
+                           ((f"cat {i}", HEAVY_CHAT) for i in range(args.heavy)))
+
+
+def cursor_of_page(chat_id, page):
+    """Курсор after, с которого начинается страница номер page (0 — первая)."""
+    if page == 0:
+        return 0
+    with db.read() as cursor:
+        cursor.execute("SELECT id FROM categories WHERE chat_id = ? ORDER BY id LIMIT 1 OFFSET ?",
+                       (chat_id, page * tracker.PAGE_SIZE - 1))
+        return cursor.fetchone()[0]
+
+
+def measure(label, func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"{label}: p50={samples[len(samples) // 2] * 1000:.3f} ms "
+          f"p99={samples[int(len(samples) * 0.99)] * 1000:.3f} ms")
+
+
+def all_categories():
+    """Прежний categories_view: все категории всех пользователей."""
+    with db.read() as cursor:
+        cursor.execute("SELECT id, name FROM categories")
+        return cursor.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=10_000)
+    parser.add_argument("--categories", type=int, default=100, help="категорий у обычного чата")
+    parser.add_argument("--heavy", type=int, default=100_000, help="категорий у тяжёлого чата")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate(db.get_connection())
+        started = time.perf_counter()
+        populate(args)
+        total = args.chats * args.categories + args.heavy
+        print(f"{total} categories inserted in {time.perf_counter() - started:.1f} s")
+        measure("all categories (old screen)", all_categories, max(1, args.repeat // 20))
+        last_page = (args.heavy - 1) // tracker.PAGE_SIZE
+        for name, page in (("first", 0), ("middle", last_page // 2), ("last", last_page)):
+            after = cursor_of_page(HEAVY_CHAT, page)
+            measure(f"heavy chat, {name} page", lambda: tracker.category_page(HEAVY_CHAT, after), args.repeat)
+        measure("regular chat, first page", lambda: tracker.category_page(args.chats // 2, 0), args.repeat)
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Стоимость диспетчеризации одного callback'а: цепочка startswith-предикатов против Router.
+
+Линейный вариант повторяет то, как telebot перебирает callback_query_handler по очереди.
+Router сравнивается без обёртки metrics.timed (её стоимость — в последней колонке отдельно),
+иначе вместо диспетчеризации замерялись бы метрики.
+
+Запуск: python benchmarks/bench_router.py [--actions 10 50 200] [--updates 200000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router import Router, encode
+
+
+def handler(call, *args):
+    return args
+
+
+def build_linear(actions):
+    handlers = []
+    for action in actions:
+        prefix = action + "_"
+        handlers.append((lambda call, prefix=prefix: call.data.startswith(prefix), handler))
+    return handlers
+
+
+def dispatch_linear(handlers, call):
+    for predicate, func in handlers:
+        if predicate(call):
+            return func(call, int(call.data.split("_")[-1]))
+
+
+def measure(func, calls):
+    started = time.perf_counter()
+    for call in calls:
+        func(call)
+    return (time.perf_counter() - started) / len(calls) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--actions", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--updates", type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f"{'actions':>8} {'linear ns/update':>18} {'router ns/update':>18} {'+metrics ns/update':>20}")
+    for n in args.actions:
+        actions = [f"action{i}" for i in range(n)]
+        linear = build_linear(actions)
+        router = Router(instrument=False)
+        timed_router = Router()
+        for action in actions:
+            router.callback(action)(handler)
+            timed_router.callback(action)(handler)
+        picks = [random.choice(actions) for _ in range(args.updates)]
+        linear_calls = [SimpleNamespace(data=f"{action}_{i}") for i, action in enumerate(picks)]
+        router_calls = [SimpleNamespace(data=encode(action, i)) for i, action in enumerate(picks)]
+        linear_ns = measure(lambda call: dispatch_linear(linear, call), linear_calls)
+        router_ns = measure(router.dispatch_callback, router_calls)
+        timed_ns = measure(timed_router.dispatch_callback, router_calls)
+        print(f"{n:>8} {linear_ns:>18.0f} {router_ns:>18.0f} {timed_ns:>20.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Планы и задержки горячих запросов tasks.db до и после миграций индексов.
+
+Запуск: python benchmarks/bench_schema.py [--tasks 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import stub_config
+
+stub_config()
+
+import db
+import migrations
+
+QUERIES = {
+    "timer_tick": ('''
+        SELECT ct.task_id, ct.start_time, ct.saved_time, t.name, c.name
+        FROM current_task ct
+        JOIN tasks t ON ct.task_id = t.id
+        JOIN categories c ON t.category_id = c.id
+        WHERE ct.chat_id = ?
+    ''', "chat"),
+    "view_tasks": ("SELECT id, name, total_time FROM tasks WHERE category_id = ?", "category"),
+}
+
+
+def populate(conn, n_tasks, n_categories, n_chats):
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO categories (id, name) VALUES (?, ?)",
+                     ((i, f"cat {i}") for i in range(1, n_categories + 1)))
+    conn.executemany("INSERT INTO tasks (id, category_id, name, total_time) VALUES (?, ?, ?, ?)",
+                     ((i, random.randint(1, n_categories), f"task {i}", random.randint(0, 10000))
+                      for i in range(1, n_tasks + 1)))
+    conn.executemany("INSERT INTO current_task (chat_id, task_id, start_time, saved_time) VALUES (?, ?, ?, 0)",
+                     ((chat_id, random.randint(1, n_tasks), int(time.time())) for chat_id in range(1, n_chats + 1)))
+    conn.commit()
+
+
+def measure(conn, label, n_categories, n_chats, repeat):
+    print(f"--- {label} (schema version {migrations.get_version(conn)})")
+    for name, (sql, kind) in QUERIES.items():
+        upper = n_chats if kind == "chat" else n_categories
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, (1,)).fetchall()
+        samples = []
+        for _ in range(repeat):
+            key = random.randint(1, upper)
+            started = time.perf_counter()
+            conn.execute(sql, (key,)).fetchall()
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        print(f"{name}: p50={samples[len(samples) // 2] * 1000:.3f} ms "
+              f"p99={samples[int(len(samples) * 0.99)] * 1000:.3f} ms")
+        for row in plan:
+            print(f"    {row[-1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=10_000)
+    parser.add_argument("--chats", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.connect(os.path.join(tmp, "bench.db"))
+        migrations.migrate(conn, target=1)
+        populate(conn, args.tasks, args.categories, args.chats)
+        measure(conn, "before", args.categories, args.chats, args.repeat)
+        started = time.perf_counter()
+        migrations.migrate(conn)
+        print(f"migration took {time.perf_counter() - started:.2f} s")
+        measure(conn, "after", args.categories, args.chats, args.repeat)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Холодный старт бота: отчёт python -X importtime для модуля движка и время до ответа на первое обновление.
+
+Бот запускается в отдельном процессе с временным config.py, который направляет
+Bot API на локальную заглушку (fake_api). Заглушка отдаёт одно сообщение /start и
+фиксирует момент первого sendMessage.
+
+Запуск: python benchmarks/bench_startup.py [--top 15] [--budget-ms 1500]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_api import ROOT, TOKEN, FakeBotApi, message_update
+
+# bot.py — лёгкая точка входа, основная стоимость импорта — у модуля движка
+ENGINE_MODULE = "threaded_bot"
+
+
+def import_report(env, top):
+    """Разбирает вывод -X importtime: (общее время, [(накопленное мкс, модуль), ...])."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {ENGINE_MODULE}"],
+                          cwd=env["BENCH_CWD"], env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"import {ENGINE_MODULE} failed:\n{proc.stderr[-2000:]}")
+    rows = []
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.rstrip()))
+        if name.strip() == ENGINE_MODULE:
+            total = int(cumulative_us)
+    rows.sort(reverse=True)
+    return total, rows[:top]
+
+
+def time_to_first_update(env, timeout):
+    server = FakeBotApi().start()
+    server.push([message_update(1, 1, "/start")])
+    with open(os.path.join(env["BENCH_CWD"], "config.py"), "a") as f:
+        f.write(f"API_URL = {server.api_url!r}\n")
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], cwd=env["BENCH_CWD"], env=env)
+    try:
+        while server.first_send is None and time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                sys.exit("bot exited before answering the first update")
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait()
+        server.shutdown()
+    if server.first_send is None:
+        sys.exit(f"no reply within {timeout} s")
+    return server.first_send - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="завершиться с ошибкой, если импорт движка дольше бюджета")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "config.py"), "w") as f:
+            f.write(f"TOKEN = {TOKEN!r}\nDB_PATH = {os.path.join(tmp, 'tasks.db')!r}\nCHART_PREWARM_DELAY = None\n")
+        env = dict(os.environ, BENCH_CWD=tmp,
+                   PYTHONPATH=os.pathsep.join([tmp, ROOT, os.environ.get("PYTHONPATH", "")]))
+        total_us, rows = import_report(env, args.top)
+        print(f"import {ENGINE_MODULE}: {total_us / 1000:.1f} ms")
+        for cumulative_us, name in rows:
+            print(f"{cumulative_us / 1000:10.1f} ms  {name}")
+        ttfu = time_to_first_update(env, args.timeout)
+        print(f"time to first update: {ttfu * 1000:.1f} ms")
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        sys.exit(f"import time {total_us / 1000:.1f} ms exceeds budget {args.budget_ms} ms")
+
+
+if __name__ == '__main__':
+    main()
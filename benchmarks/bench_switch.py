@@ -0,0 +1,71 @@
+"""Задержка переключения задачи: прежняя схема (stop_task, затем запуск новой задачи
+отдельной транзакцией) против tracker.switch_task одной транзакцией.
+
+Запуск: python benchmarks/bench_switch.py [--switches 5000] [--chats 100]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import stub_config
+
+stub_config()
+
+import db
+import migrations
+import tracker
+
+
+def populate(n_categories, n_tasks):
+    with db.transaction() as cursor:
+        cursor.executemany("INSERT INTO categories (id, name) VALUES (?, ?)",
+                           ((i, f"cat {i}") for i in range(1, n_categories + 1)))
+        cursor.executemany("INSERT INTO tasks (id, category_id, name) VALUES (?, ?, ?)",
+                           ((i, random.randint(1, n_categories), f"task {i}") for i in range(1, n_tasks + 1)))
+
+
+def two_step_switch(chat_id, task_id):
+    """Прежний порядок handle_select_task: stop_timer, затем start_timer (который снова закрывал задачу)."""
+    tracker.stop_task(chat_id)
+    tracker.stop_task(chat_id)
+    tracker.switch_task(chat_id, task_id)
+
+
+def measure(label, func, args):
+    samples = []
+    for _ in range(args.switches):
+        chat_id = random.randint(1, args.chats)
+        task_id = random.randint(1, args.tasks)
+        started = time.perf_counter()
+        func(chat_id, task_id)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"{label}: p50={samples[len(samples) // 2] * 1000:.3f} ms "
+          f"p99={samples[int(len(samples) * 0.99)] * 1000:.3f} ms "
+          f"total={sum(samples):.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--switches", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        migrations.migrate(db.get_connection())
+        populate(args.categories, args.tasks)
+        measure("stop + start", two_step_switch, args)
+        measure("switch_task", tracker.switch_task, args)
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
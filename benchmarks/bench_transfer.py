@@ -0,0 +1,93 @@
+"""Импорт и экспорт больших объёмов: время и пиковая память (ru_maxrss) на rows строк журнала.
+
+Каждая фаза — отдельный процесс, чтобы пик памяти одной не смешивался с другой:
+сгенерированный CSV импортируется в пустую базу, затем база выгружается в CSV и JSON Lines.
+Память не должна расти вместе с rows — сравните, например, --rows 100000 и --rows 1000000.
+
+Запуск: python benchmarks/bench_transfer.py [--rows 1000000] [--categories 10] [--tasks 10]
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHAT_ID = 1
+STEP = 600
+
+
+def generate(path, rows, categories, tasks):
+    """CSV журнала: rows отрезков по 5 минут каждые 10 минут, заканчивая сейчас; задачи по кругу."""
+    first = int(time.time()) - rows * STEP
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(("category", "task", "start", "end"))
+        for i in range(rows):
+            start = first + i * STEP
+            writer.writerow((f"cat {i % categories}", f"task {i // categories % tasks}", start, start + 300))
+
+
+def run_phase(args):
+    from fake_api import stub_config
+
+    stub_config()
+    import db
+    import migrations
+    import transfer
+
+    db.DB_PATH = args.db
+    migrations.migrate(db.get_connection())
+    started = time.perf_counter()
+    if args.phase == "import":
+        with open(args.file, "rb") as f:
+            summary = transfer.import_file(CHAT_ID, f, os.path.basename(args.file))
+        result = {"rows": summary["imported"], "invalid": summary["invalid"]}
+    else:
+        file, name, rows = transfer.write_export(CHAT_ID, args.phase, "entries")
+        with file:
+            size = file.seek(0, os.SEEK_END)
+        result = {"rows": rows, "file": name, "mb": round(size / 2 ** 20, 1)}
+    elapsed = time.perf_counter() - started
+    db.close_all()
+    result.update({
+        "phase": args.phase,
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(result["rows"] / elapsed),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=10, help="задач в категории")
+    parser.add_argument("--phase", choices=("import", "csv", "jsonl"), help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.phase:
+        run_phase(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "entries.csv")
+        started = time.perf_counter()
+        generate(source, args.rows, args.categories, args.tasks)
+        print(f"{args.rows} rows generated ({os.path.getsize(source) / 2 ** 20:.1f} MB) "
+              f"in {time.perf_counter() - started:.1f} s")
+        db_path = os.path.join(tmp, "bench.db")
+        for phase in ("import", "csv", "jsonl"):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--phase", phase,
+                            "--db", db_path, "--file", source], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Приём обновлений через webhook против long polling: обновлений в секунду и задержка p50/p99.
+
+Бот запускается отдельным процессом (python bot.py --mode webhook) с заглушкой Bot API
+из fake_api. Нажатия "Категории" отправляются POST-запросами на встроенный
+webhook-сервер в несколько соединений; задержка — от отправки до answerCallbackQuery.
+Для сравнения тот же поток нажатий прогоняется через getUpdates.
+
+С --replay FILE вместо синтетических нажатий отправляются записанные обновления
+(по одному JSON на строку) и печатаются коды ответов — так webhook проверяется локально.
+
+Запуск: python benchmarks/bench_webhook.py [--updates 2000] [--connections 8] [--engines threaded asyncio]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from bench_engines import run_engine, seed
+from fake_api import FakeBotApi, bot_config, callback_update, percentile, start_bot
+
+SECRET = "bench-secret"
+PATH = "/telegram"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def post_all(port, updates, connections, on_sent=None, secret=SECRET):
+    """Отправляет обновления в connections потоков (keep-alive). Возвращает счётчик кодов ответа."""
+    statuses = Counter()
+    lock = threading.Lock()
+    chunks = [updates[i::connections] for i in range(connections)]
+
+    def worker(chunk):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret}
+        for update in chunk:
+            if on_sent is not None:
+                on_sent(update)
+            conn.request("POST", PATH, json.dumps(update), headers)
+            response = conn.getresponse()
+            response.read()
+            with lock:
+                statuses[response.status] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def run_webhook(engine, args):
+    server = FakeBotApi().start()
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(os.path.join(tmp, "tasks.db"), args.categories, range(10_000, 10_000 + args.users))
+        bot_config(tmp, server, OUTBOX_GLOBAL_RATE=10 ** 9, OUTBOX_CHAT_RATE=10 ** 9, OUTBOX_CHAT_BURST=10 ** 9,
+                   WEBHOOK_HOST="127.0.0.1", WEBHOOK_PORT=port, WEBHOOK_PATH=PATH, WEBHOOK_SECRET=SECRET)
+        proc = start_bot(tmp, "--engine", engine, "--mode", "webhook")
+        try:
+            if not wait_for_port(port):
+                sys.exit(f"{engine}: webhook server did not start")
+            if args.replay:
+                with open(args.replay) as f:
+                    updates = [json.loads(line) for line in f if line.strip()]
+                statuses = post_all(port, updates, args.connections)
+                rejected = post_all(port, updates[:1], 1, secret="wrong")
+                time.sleep(2)
+                return {"engine": engine, "mode": "webhook", "posted": len(updates),
+                        "statuses": dict(statuses), "wrong_secret": dict(rejected)}
+            updates = [callback_update(i + 1, 10_000 + i % args.users, "menu:categories") for i in range(args.updates)]
+            statuses = post_all(port, updates, args.connections, server.mark_sent)
+            deadline = time.perf_counter() + args.timeout
+            while len(server.answered) < args.updates and time.perf_counter() < deadline:
+                time.sleep(0.05)
+        finally:
+            proc.terminate()
+            proc.wait()
+            server.shutdown()
+    latencies = [server.answered[k] - server.handed_out[k] for k in server.answered if k in server.handed_out]
+    if not latencies:
+        return {"engine": engine, "mode": "webhook", "answered": 0, "statuses": dict(statuses)}
+    elapsed = max(server.answered.values()) - min(server.handed_out.values())
+    return {
+        "engine": engine,
+        "mode": "webhook",
+        "answered": len(latencies),
+        "statuses": dict(statuses),
+        "updates_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--engines", nargs="+", default=["threaded", "asyncio"])
+    parser.add_argument("--replay", help="файл с записанными обновлениями (JSON Lines)")
+    parser.add_argument("--no-polling", action="store_true", help="не прогонять сравнение с getUpdates")
+    args = parser.parse_args()
+    for engine in args.engines:
+        print(json.dumps(run_webhook(engine, args)))
+        if not args.replay and not args.no_polling:
+            print(json.dumps(dict(run_engine(engine, args), mode="polling")))
+
+
+if __name__ == '__main__':
+    main()
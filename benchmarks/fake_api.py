@@ -0,0 +1,287 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков и нагрузочных прогонов.
+
+FakeBotApi понимает getMe, getUpdates (long polling из очереди), sendMessage,
+editMessageText, sendPhoto, sendDocument, answerCallbackQuery, deleteMessage, setWebhook/deleteWebhook
+и getFile со скачиванием по FILE_URL (содержимое — в files),
+отвечает правдоподобными объектами Message и считает вызовы и ошибки по методам.
+Бот направляется на неё через API_URL в config.py (см. bot_config/start_bot).
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123:bench"
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), FakeApiHandler)
+        self.latency = latency            # искусственная задержка каждого ответа, с
+        self.lock = threading.Condition()
+        self.queue = []
+        self.handed_out = {}              # callback id -> время выдачи боту
+        self.answered = {}                # callback id -> время answerCallbackQuery
+        self.polled = threading.Event()
+        self.first_send = None
+        self.calls = Counter()            # метод -> число вызовов
+        self.errors = Counter()           # метод -> число ответов с ошибкой
+        self.next_message_id = 1000
+        self.files = {}                   # file_id -> байты для getFile и скачивания
+        self.documents = []               # (chat_id, имя файла, байты) из sendDocument
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_port}/bot{{0}}/{{1}}"
+
+    @property
+    def file_url(self):
+        return f"http://127.0.0.1:{self.server_port}/file/bot{{0}}/{{1}}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Бот при остановке обрывает long polling — это не ошибка заглушки
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    # --- очередь обновлений ---
+
+    def push(self, updates):
+        with self.lock:
+            self.queue.extend(updates)
+            self.lock.notify_all()
+
+    def mark_sent(self, update, now=None):
+        """Запоминает момент передачи нажатия боту (для webhook, где getUpdates нет)."""
+        call = update.get("callback_query")
+        if call is not None:
+            with self.lock:
+                self.handed_out[call["id"]] = time.perf_counter() if now is None else now
+
+    def take_updates(self, limit=100, wait=0.5):
+        with self.lock:
+            if not self.queue:
+                self.lock.wait(wait)
+            batch, self.queue = self.queue[:limit], self.queue[limit:]
+            now = time.perf_counter()
+            for update in batch:
+                if "callback_query" in update:
+                    self.handed_out[update["callback_query"]["id"]] = now
+            return batch
+
+    def wait_answer(self, callback_id, timeout):
+        """Ждёт answerCallbackQuery для нажатия. Возвращает время ответа или None."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while callback_id not in self.answered:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.lock.wait(remaining)
+            return self.answered[callback_id]
+
+    # --- методы Bot API ---
+
+    def _message(self, params, message_id=None):
+        if message_id is None:
+            with self.lock:
+                self.next_message_id += 1
+                message_id = self.next_message_id
+        return {"message_id": int(message_id), "date": int(time.time()), "text": params.get("text", ""),
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "private"}}
+
+    def call(self, method, params):
+        """Результат метода или None для неизвестного метода."""
+        with self.lock:
+            self.calls[method] += 1
+        if method == "getUpdates":
+            self.polled.set()
+            return self.take_updates(int(params.get("limit") or 100), wait=0.5)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ("sendMessage", "sendPhoto"):
+            with self.lock:
+                if self.first_send is None:
+                    self.first_send = time.perf_counter()
+            return self._message(params)
+        if method == "sendDocument":
+            with self.lock:
+                self.documents.append((int(params.get("chat_id") or 0), params.get("file_name"), params.get("document")))
+            return self._message(params)
+        if method == "getFile":
+            file_id = params.get("file_id")
+            if file_id not in self.files:
+                return None
+            return {"file_id": file_id, "file_unique_id": file_id,
+                    "file_size": len(self.files[file_id]), "file_path": f"documents/{file_id}"}
+        if method == "editMessageText":
+            return self._message(params, params.get("message_id") or 0)
+        if method == "answerCallbackQuery":
+            with self.lock:
+                self.answered[params.get("callback_query_id")] = time.perf_counter()
+                self.lock.notify_all()
+            return True
+        if method in ("deleteMessage", "setWebhook", "deleteWebhook"):
+            return True
+        return None
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят разными write: без TCP_NODELAY Nagle и отложенный ACK
+    # клиента добавляют ~40 мс к каждому вызову на keep-alive соединении
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self):
+        params = dict(parse_qsl(urlsplit(self.path).query))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type") or ""
+        if body and "json" in content_type:
+            params.update(json.loads(body))
+        elif body and "multipart" in content_type:
+            params.update(parse_multipart(body, content_type))
+        elif body:
+            params.update(parse_qsl(body.decode()))
+        return params
+
+    def _send_file(self, file_id):
+        body = self.server.files.get(file_id)
+        self.send_response(200 if body is not None else 404)
+        body = body if body is not None else b""
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        path = urlsplit(self.path).path
+        if path.startswith("/file/"):
+            self._send_file(path.rsplit("/", 1)[-1])
+            return
+        method = path.rsplit("/", 1)[-1]
+        params = self._params()
+        if server.latency and method != "getUpdates":
+            time.sleep(server.latency)
+        result = server.call(method, params)
+        if result is None:
+            with server.lock:
+                server.errors[method] += 1
+            payload = {"ok": False, "error_code": 404, "description": f"Not Found: method {method}"}
+            status = 404
+        else:
+            payload = {"ok": True, "result": result}
+            status = 200
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+
+def parse_multipart(body, content_type):
+    """Поля multipart/form-data: текстовые — строками, файлы — байтами (имя файла — в file_name)."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    params = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        filename = part.get_filename()
+        payload = part.get_payload(decode=True)
+        if filename is not None:
+            params[name] = payload
+            params["file_name"] = filename
+        else:
+            params[name] = payload.decode()
+    return params
+
+
+# ==========================
+# Обновления и запуск бота
+# ==========================
+def user(chat_id):
+    return {"id": chat_id, "is_bot": False, "first_name": "u"}
+
+
+def callback_update(update_id, chat_id, data, message_id=1):
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": user(chat_id), "chat_instance": str(chat_id), "data": data,
+        "message": {"message_id": message_id, "date": int(time.time()), "text": "Главное меню",
+                    "chat": {"id": chat_id, "type": "private"}, "from": user(chat_id)}}}
+
+
+def message_update(update_id, chat_id, text, message_id=None):
+    message = {"message_id": message_id or update_id, "date": int(time.time()), "text": text,
+               "chat": {"id": chat_id, "type": "private"}, "from": user(chat_id)}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bot_config(directory, api, **settings):
+    """Пишет config.py для бота: токен, база в directory, Bot API на заглушке и доп. настройки."""
+    settings.setdefault("CHART_PREWARM_DELAY", None)
+    lines = [f"TOKEN = {TOKEN!r}", f"DB_PATH = {os.path.join(directory, 'tasks.db')!r}",
+             f"API_URL = {api.api_url!r}", f"FILE_URL = {api.file_url!r}"]
+    lines += [f"{name} = {value!r}" for name, value in settings.items()]
+    with open(os.path.join(directory, "config.py"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def stub_config():
+    """Пустой модуль config, если config.py не найден (чистый checkout без секретов).
+
+    Для бенчмарков, которые работают с модулями бота в своём процессе: все настройки
+    берутся по умолчанию, а путь к базе бенчмарк задаёт сам через db.DB_PATH.
+    """
+    try:
+        import config  # noqa: F401
+    except ModuleNotFoundError:
+        sys.modules["config"] = types.ModuleType("config")
+
+
+def bot_env(directory):
+    return dict(os.environ, PYTHONPATH=os.pathsep.join([directory, ROOT, os.environ.get("PYTHONPATH", "")]))
+
+
+def start_bot(directory, *args):
+    """Запускает bot.py отдельным процессом с config.py из directory."""
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py"), *args], cwd=directory, env=bot_env(directory))
+
+
+def final_stats(directory):
+    """Итоговая статистика, которую бот пишет в log.txt при остановке по SIGTERM."""
+    path = os.path.join(directory, "log.txt")
+    if not os.path.exists(path):
+        return None
+    stats = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if " - Final stats: " in line:
+                stats = json.loads(line.split(" - Final stats: ", 1)[1])
+    return stats
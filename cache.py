@@ -0,0 +1,137 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кеш ограниченного размера со счётчиками попаданий."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+# ==========================
+# Кеш метаданных категорий и задач
+# ==========================
+# Названия и владельцы категорий и задач меняются редко, а читаются на каждом тике
+# таймера и при каждой проверке доступа. Значения загружаются из базы при промахе,
+# а обработчики, меняющие данные, явно сбрасывают затронутые ключи после commit.
+# Списки для клавиатур сюда не попадают: они читаются постранично (tracker.category_page).
+_MISSING = object()
+
+
+class MetadataCache:
+    def __init__(self, maxsize=10000):
+        self._lru = LRUCache(maxsize)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key, loader):
+        value = self._lru.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            generation = self._generation
+        with db.read() as cursor:
+            value = loader(cursor)
+        with self._lock:
+            # Если во время загрузки что-то сбросили, значение могло устареть — не кешируем
+            if generation == self._generation:
+                self._lru.put(key, value)
+        return value
+
+    def _invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._lru.pop(key)
+
+    # --- чтение ---
+
+    def category(self, cat_id):
+        """(название, chat_id владельца) категории или None."""
+        def load(cursor):
+            cursor.execute("SELECT name, chat_id FROM categories WHERE id = ?", (cat_id,))
+            return cursor.fetchone()
+        return self._get(("category", cat_id), load)
+
+    def category_name(self, cat_id):
+        category = self.category(cat_id)
+        return category[0] if category else None
+
+    def task(self, task_id):
+        """(название, category_id, chat_id владельца) задачи или None."""
+        def load(cursor):
+            cursor.execute("SELECT name, category_id, chat_id FROM tasks WHERE id = ?", (task_id,))
+            return cursor.fetchone()
+        return self._get(("task", task_id), load)
+
+    def current_task(self, chat_id):
+        """(task_id, start_time, saved_time) запущенной задачи чата или None."""
+        def load(cursor):
+            cursor.execute("SELECT task_id, start_time, saved_time FROM current_task WHERE chat_id = ?", (chat_id,))
+            return cursor.fetchone()
+        return self._get(("current", chat_id), load)
+
+    def prime_current(self, rows):
+        """Заполняет кеш текущих задач пачкой строк (chat_id, task_id, start_time, saved_time)."""
+        with self._lock:
+            for chat_id, task_id, start_time, saved_time in rows:
+                self._lru.put(("current", chat_id), (task_id, start_time, saved_time))
+
+    # --- сброс ---
+
+    def invalidate_category(self, cat_id):
+        self._invalidate(("category", cat_id))
+
+    def invalidate_task(self, task_id):
+        self._invalidate(("task", task_id))
+
+    def invalidate_current(self, chat_id):
+        self._invalidate(("current", chat_id))
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._lru.clear()
+
+    def stats(self):
+        return {"hits": self._lru.hits, "misses": self._lru.misses, "size": len(self._lru)}
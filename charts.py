@@ -0,0 +1,220 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cache import LRUCache
+from metrics import CHART_RENDER_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Построение графиков в памяти
+# ==========================
+# Графики рисуются через объектный API Agg (без pyplot и его глобального состояния)
+# прямо в BytesIO, а готовые PNG кешируются по хешу данных: пока новое время не
+# записано, повторный просмотр статистики не перерисовывает график.
+# matplotlib импортируется лениво, при первой отрисовке, — импорт этого модуля дешёвый.
+CHART_CACHE_SIZE = 256
+CHART_TITLE = "Статистика по времени"
+
+chart_cache = LRUCache(CHART_CACHE_SIZE)
+
+
+def chart_key(data):
+    """Хеш данных графика (порядок категорий важен — он же порядок столбцов)."""
+    digest = hashlib.blake2b(digest_size=16)
+    for label, value in data.items():
+        digest.update(f"{label}\x00{value}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def render_chart(data):
+    """Рисует столбчатую диаграмму и возвращает PNG в виде bytes."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.bar(list(data.keys()), list(data.values()))
+    ax.set_title(CHART_TITLE)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def timed_render(data):
+    """render_chart для процесса пула: (PNG, время отрисовки в секундах)."""
+    started = time.perf_counter()
+    png = render_chart(data)
+    return png, time.perf_counter() - started
+
+
+def warm_up():
+    """Импортирует matplotlib и рисует пустой график, чтобы первая отрисовка была быстрой."""
+    render_chart({"": 0})
+    return True
+
+
+def has_chart(data):
+    return bool(data) and sum(data.values()) != 0
+
+
+# ==========================
+# Отрисовка в отдельных процессах
+# ==========================
+PARENT_CHECK_INTERVAL = 1
+
+
+def _watch_parent(parent_pid):
+    """Инициализатор процесса пула: завершает его, если процесс бота умер (например, по SIGTERM).
+
+    Без этого осиротевшие рабочие процессы остаются висеть в ожидании заданий.
+    """
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(PARENT_CHECK_INTERVAL)
+        os._exit(0)
+
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+
+class ChartRenderer:
+    """Рендерит графики в пуле процессов, чтобы matplotlib не держал GIL потоков бота.
+
+    Очередь ограничена max_pending: при переполнении submit сразу возвращает False.
+    Зависший рендер по истечении timeout снимается, а пул процессов пересоздаётся.
+    Готовый PNG передаётся в callback из отдельного потока доставки.
+    """
+
+    def __init__(self, workers=1, max_pending=8, timeout=20):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._delivery = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chart-delivery")
+        self.pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, а не fork: процесс бота многопоточный
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_watch_parent, initargs=(os.getpid(),))
+            return self._executor
+
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+
+    def _submit_render(self, data):
+        """Отправляет рендер в пул; сломанный пул пересоздаётся один раз. Возвращает (пул, future)."""
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(timed_render, data)
+        except (BrokenProcessPool, RuntimeError) as e:
+            logger.exception("Chart pool is unavailable, recreating: %s", e)
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(timed_render, data)
+
+    def submit(self, data, callback):
+        """Ставит график в очередь. True — callback(png) будет вызван, False — графика не будет."""
+        if not has_chart(data):
+            return False
+        key = chart_key(data)
+        png = chart_cache.get(key)
+        if png is not None:
+            self._delivery.submit(callback, png)
+            return True
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            logger.warning("Chart queue is full, rejecting render")
+            return False
+        try:
+            executor, future = self._submit_render(data)
+        except Exception as e:
+            # Слот занят до завершения рендера — если рендер не запущен, его нужно вернуть
+            self._slots.release()
+            logger.exception("Error submitting chart render: %s", e)
+            return False
+        with self._lock:
+            self.pending += 1
+        state = {"done": False}
+        state_lock = threading.Lock()
+
+        def finish():
+            with state_lock:
+                if state["done"]:
+                    return False
+                state["done"] = True
+            watchdog.cancel()
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+            return True
+
+        def on_timeout():
+            if finish():
+                self.timeouts += 1
+                logger.error("Chart render timed out after %s s, restarting chart workers", self.timeout)
+                self._reset_executor(executor)
+
+        def on_done(fut):
+            if not finish():
+                return
+            try:
+                result, seconds = fut.result()
+            except Exception as e:
+                logger.exception("Error generating chart: %s", e)
+                if isinstance(e, BrokenProcessPool):
+                    self._reset_executor(executor)
+                return
+            CHART_RENDER_SECONDS.observe(seconds)
+            chart_cache.put(key, result)
+            logger.info("Chart generated (%s bytes)", len(result))
+            self._delivery.submit(callback, result)
+
+        watchdog = threading.Timer(self.timeout, on_timeout)
+        watchdog.daemon = True
+        watchdog.start()
+        future.add_done_callback(on_done)
+        return True
+
+    def prewarm(self):
+        """Поднимает процессы пула и заранее загружает в них matplotlib."""
+        try:
+            executor = self._get_executor()
+            for _ in range(self.workers):
+                executor.submit(warm_up)
+        except Exception as e:
+            logger.exception("Error pre-warming chart workers: %s", e)
+        else:
+            logger.info("Chart workers pre-warm started")
+
+    def stats(self):
+        return {"pending": self.pending, "rejected": self.rejected, "timeouts": self.timeouts,
+                "cache": {"hits": chart_cache.hits, "misses": chart_cache.misses, "size": len(chart_cache)}}
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._delivery.shutdown(wait=False)
@@ -0,0 +1,132 @@
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Слой соединений с SQLite
+# ==========================
+# У каждого потока своё долгоживущее соединение: обработчики telebot и воркеры
+# таймеров больше не открывают и не закрывают базу на каждый запрос.
+DB_PATH = getattr(config, "DB_PATH", "tasks.db")
+BUSY_TIMEOUT_MS = getattr(config, "DB_BUSY_TIMEOUT_MS", 5000)
+CACHED_STATEMENTS = 256
+# BEGIN IMMEDIATE дольше порога считается ожиданием блокировки записи
+LOCK_WAIT_THRESHOLD = 0.001
+
+_local = threading.local()
+_connections = set()
+_connections_lock = threading.Lock()
+_stats = {"transactions": 0, "lock_waits": 0, "lock_wait_time": 0.0}
+_stats_lock = threading.Lock()
+
+
+def connect(path=None):
+    """Открывает новое соединение с настроенными pragma (WAL, synchronous=NORMAL, busy_timeout)."""
+    conn = sqlite3.connect(
+        path or DB_PATH,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,          # транзакциями управляем явно через transaction()
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # Каждое выражение засчитывается обработчику, в контексте которого выполняется
+    conn.set_trace_callback(metrics.count_query)
+    return conn
+
+
+def get_connection():
+    """Соединение текущего потока (создаётся при первом обращении)."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = connect()
+        _local.conn = conn
+        _local.depth = 0
+        with _connections_lock:
+            _connections.add(conn)
+    return conn
+
+
+def close_connection():
+    """Закрывает соединение текущего потока."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        with _connections_lock:
+            _connections.discard(conn)
+        conn.close()
+        _local.conn = None
+
+
+def close_all():
+    with _connections_lock:
+        conns = list(_connections)
+        _connections.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.exception("Error closing connection: %s", e)
+    _local.conn = None
+
+
+@contextmanager
+def transaction():
+    """Пишущая транзакция (BEGIN IMMEDIATE): commit при выходе, rollback при исключении.
+
+    Вложенные вызовы в том же потоке выполняются внутри внешней транзакции.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield cursor
+        finally:
+            _local.depth -= 1
+        return
+    started = time.perf_counter()
+    cursor.execute("BEGIN IMMEDIATE")
+    waited = time.perf_counter() - started
+    with _stats_lock:
+        _stats["transactions"] += 1
+        if waited > LOCK_WAIT_THRESHOLD:
+            _stats["lock_waits"] += 1
+            _stats["lock_wait_time"] += waited
+    _local.depth = 1
+    try:
+        yield cursor
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+    finally:
+        _local.depth = 0
+        metrics.observe_db(time.perf_counter() - started)
+
+
+def stats():
+    """Счётчики пишущих транзакций и ожиданий блокировки записи."""
+    with _stats_lock:
+        return dict(_stats, lock_wait_time=round(_stats["lock_wait_time"], 6))
+
+
+@contextmanager
+def read():
+    """Курсор для чтения вне явной транзакции (в WAL читатели не блокируют писателей)."""
+    started = time.perf_counter()
+    try:
+        yield get_connection().cursor()
+    finally:
+        metrics.observe_db(time.perf_counter() - started)
@@ -0,0 +1,139 @@
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Очереди обновлений по чатам
+# ==========================
+# chat_id хешируется на одну из N полос. Каждая полоса — ограниченная очередь и один
+# поток: обновления одного чата обрабатываются строго по порядку (два быстрых нажатия
+# не гоняются в stop_timer/start_timer), а разные чаты идут параллельно в других полосах.
+DROP_FULL = "full"        # полоса переполнена
+DROP_MERGED = "merged"    # такое же нажатие уже ждёт в очереди
+
+
+def update_chat_id(update):
+    """chat_id, к которому относится обновление, или None."""
+    if update.message is not None:
+        return update.message.chat.id
+    if update.edited_message is not None:
+        return update.edited_message.chat.id
+    call = update.callback_query
+    if call is not None:
+        return call.message.chat.id if call.message is not None else call.from_user.id
+    return None
+
+
+def update_merge_key(update):
+    """Ключ склейки повторных нажатий: одна и та же кнопка одного сообщения.
+
+    Текстовые сообщения не склеиваются — это ввод пользователя.
+    """
+    call = update.callback_query
+    if call is None:
+        return None
+    message_id = call.message.message_id if call.message is not None else None
+    return update_chat_id(update), message_id, call.data
+
+
+class _Lane:
+    __slots__ = ("queue", "merge_keys", "cond", "thread", "processed")
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.merge_keys = set()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.processed = 0
+
+
+class UpdateLanes:
+    """Пул полос обработки: handler(item) вызывается в потоке полосы, выбранной по ключу.
+
+    Очередь каждой полосы ограничена max_depth. Переполнение и повторное нажатие, которое
+    уже ждёт в очереди, не ставятся в очередь: вместо этого вызывается on_drop(item, reason).
+    """
+
+    def __init__(self, handler, workers=4, max_depth=100, on_drop=None, name="lane"):
+        self.max_depth = max_depth
+        self._handler = handler
+        self._on_drop = on_drop
+        self._stopped = False
+        self._lanes = [_Lane() for _ in range(max(1, workers))]
+        self.merged = 0
+        self.dropped = 0
+        for index, lane in enumerate(self._lanes):
+            lane.thread = threading.Thread(target=self._run, args=(lane,), name=f"{name}-{index}", daemon=True)
+            lane.thread.start()
+
+    def __len__(self):
+        return sum(self.depths())
+
+    @property
+    def workers(self):
+        return len(self._lanes)
+
+    def lane_index(self, key):
+        return hash(key) % len(self._lanes)
+
+    def depths(self):
+        """Текущая длина очереди каждой полосы."""
+        return [len(lane.queue) for lane in self._lanes]
+
+    @property
+    def processed(self):
+        return sum(lane.processed for lane in self._lanes)
+
+    def stats(self):
+        return {"depths": self.depths(), "processed": self.processed, "merged": self.merged, "dropped": self.dropped}
+
+    def submit(self, key, item, merge_key=None):
+        """Ставит item в полосу ключа. False — item отброшен (и передан в on_drop)."""
+        lane = self._lanes[self.lane_index(key)]
+        with lane.cond:
+            if merge_key is not None and merge_key in lane.merge_keys:
+                self.merged += 1
+                reason = DROP_MERGED
+            elif len(lane.queue) >= self.max_depth:
+                self.dropped += 1
+                reason = DROP_FULL
+            else:
+                lane.queue.append((item, merge_key))
+                if merge_key is not None:
+                    lane.merge_keys.add(merge_key)
+                lane.cond.notify()
+                return True
+        if self._on_drop is not None:
+            try:
+                self._on_drop(item, reason)
+            except Exception as e:
+                logger.exception("Error handling dropped update: %s", e)
+        return False
+
+    def shutdown(self, wait=False):
+        """Останавливает полосы; уже поставленные в очередь элементы дорабатываются."""
+        self._stopped = True
+        for lane in self._lanes:
+            with lane.cond:
+                lane.cond.notify()
+        if wait:
+            for lane in self._lanes:
+                lane.thread.join()
+
+    def _run(self, lane):
+        while True:
+            with lane.cond:
+                while not lane.queue and not self._stopped:
+                    lane.cond.wait()
+                if not lane.queue:
+                    return
+                item, merge_key = lane.queue.popleft()
+                # Нажатие, пришедшее во время обработки, уже не дубликат: его ответ увидят позже
+                lane.merge_keys.discard(merge_key)
+            try:
+                self._handler(item)
+            except Exception as e:
+                logger.exception("Error processing update in %s: %s", threading.current_thread().name, e)
+            lane.processed += 1
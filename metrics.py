@@ -0,0 +1,452 @@
+import bisect
+import collections
+import contextvars
+import functools
+import inspect
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Метрики горячего пути
+# ==========================
+# Счётчики и гистограммы в памяти процесса, отдаются в текстовом формате Prometheus
+# на /metrics встроенного HTTP-сервера. Обработчики оборачиваются в @timed: это даёт
+# гистограмму задержки и привязывает к обработчику запросы к SQLite (через contextvar),
+# а вызовы Bot API замеряются обёрткой над функцией запроса telebot.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BACKGROUND = "background"
+
+current_handler = contextvars.ContextVar("current_handler", default=BACKGROUND)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}         # метки -> [счётчики по корзинам..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', f'{bound:g}')])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]:g}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}"
+
+
+class Gauge:
+    """Значение считается при каждом запросе /metrics: func() -> число или {метки: число}."""
+
+    def __init__(self, name, help, func, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = labelnames
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.exception("Error collecting metric %s: %s", self.name, e)
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, number in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {number:g}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics = [m for m in self._metrics if m.name != metric.name] + [metric]
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, func, labelnames=(), kind="gauge"):
+        """Регистрирует (или заменяет) вычисляемую метрику."""
+        return self._add(Gauge(name, help, func, labelnames, kind))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _flatten(data, prefix=""):
+    """{"db": {"transactions": 3}} -> {("db.transactions",): 3} для числовых полей."""
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[(name,)] = value
+    return items
+
+
+def register_stats(func, registry=REGISTRY):
+    """Отдаёт числовые поля runtime_stats() движка как bot_runtime_stat{name="db.transactions"}."""
+    registry.gauge("bot_runtime_stat", "Component counters from runtime_stats()",
+                   lambda: _flatten(func()), ("name",), kind="untyped")
+
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Handler latency", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Handler exceptions", ("handler",))
+DB_QUERIES = REGISTRY.counter("bot_db_queries_total", "SQLite statements executed", ("handler",))
+DB_SECONDS = REGISTRY.counter("bot_db_seconds_total", "Time spent in SQLite transactions and reads", ("handler",))
+API_SECONDS = REGISTRY.histogram("bot_api_request_seconds", "Telegram Bot API call latency", ("method",))
+API_ERRORS = REGISTRY.counter("bot_api_errors_total", "Failed Telegram Bot API calls", ("method",))
+# getUpdates ждёт обновлений весь таймаут long polling: его длительность — простой, а не задержка
+# Telegram, поэтому она пишется в свою гистограмму и не смешивается с bot_api_request_seconds
+LONG_POLL_METHOD = "getUpdates"
+POLL_SECONDS = REGISTRY.histogram("bot_api_poll_seconds", "Telegram getUpdates long-poll duration",
+                                  buckets=(0.1, 0.5, 1, 5, 10, 20, 30, 60))
+CHART_RENDER_SECONDS = REGISTRY.histogram("bot_chart_render_seconds", "Chart render time in the worker")
+
+
+# ==========================
+# Инструментирование
+# ==========================
+def _chat_id(args):
+    """chat_id из первого аргумента обработчика (Message, CallbackQuery или число)."""
+    if not args:
+        return None
+    arg = args[0]
+    if isinstance(arg, int):
+        return arg
+    message = getattr(arg, "message", None) if not hasattr(arg, "chat") else arg
+    chat = getattr(message, "chat", None)
+    return getattr(chat, "id", None)
+
+
+def timed(func=None, *, name=None):
+    """Декоратор обработчика: гистограмма задержки, ошибки, привязка запросов к БД, профилирование."""
+    if func is None:
+        return functools.partial(timed, name=name)
+    label = name or func.__name__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            token = current_handler.set(label)
+            profiling = profiler.begin(label, _chat_id(args))
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(label)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, label)
+                if profiling:
+                    profiler.end()
+                current_handler.reset(token)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = current_handler.set(label)
+        profiling = profiler.begin(label, _chat_id(args))
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(label)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, label)
+            if profiling:
+                profiler.end()
+            current_handler.reset(token)
+    return wrapper
+
+
+def count_query(statement):
+    """trace-callback соединения SQLite: считает выполненные выражения текущего обработчика."""
+    DB_QUERIES.inc(current_handler.get())
+
+
+def observe_db(seconds):
+    DB_SECONDS.inc(current_handler.get(), amount=seconds)
+
+
+def _observe_api(method, seconds):
+    if method == LONG_POLL_METHOD:
+        POLL_SECONDS.observe(seconds)
+    else:
+        API_SECONDS.observe(seconds, method)
+
+
+def instrument_api(module, attr, method_arg):
+    """Оборачивает функцию запроса telebot (apihelper._make_request / asyncio_helper._process_request):
+    задержка и ошибки по имени метода Bot API (аргумент номер method_arg)."""
+    original = getattr(module, attr)
+    if getattr(original, "__wrapped__", None) is not None:
+        return
+
+    def method_of(args, kwargs):
+        method = args[method_arg] if len(args) > method_arg else kwargs.get("method_name") or kwargs.get("url")
+        return str(method).split("?", 1)[0]
+
+    if inspect.iscoroutinefunction(original):
+        @functools.wraps(original)
+        async def wrapper(*args, **kwargs):
+            method = method_of(args, kwargs)
+            started = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            except Exception:
+                API_ERRORS.inc(method)
+                raise
+            finally:
+                _observe_api(method, time.perf_counter() - started)
+    else:
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            method = method_of(args, kwargs)
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            except Exception:
+                API_ERRORS.inc(method)
+                raise
+            finally:
+                _observe_api(method, time.perf_counter() - started)
+    setattr(module, attr, wrapper)
+
+
+# ==========================
+# Сэмплирующий профилировщик
+# ==========================
+class SamplingProfiler:
+    """Включается на лету для обработчика и/или чата: пока такой обработчик выполняется,
+    фоновый поток раз в interval секунд снимает стек его потока через sys._current_frames().
+    Результат — «свёрнутые» стеки (формат flamegraph.pl) с числом попаданий.
+
+    В асинхронном движке снимается стек потока цикла событий, то есть вместе с
+    обработчиком в выборку попадают и параллельно выполняющиеся задачи.
+    """
+
+    def __init__(self, interval=0.005, max_stacks=5000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.handler = None
+        self.chat_id = None
+        self.enabled = False
+        self.samples = collections.Counter()
+        self._active = {}             # ident потока -> (обработчик, вложенность)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def configure(self, handler=None, chat_id=None, enabled=True):
+        with self._lock:
+            self.handler = handler or None
+            self.chat_id = chat_id
+            self.enabled = enabled
+            if enabled and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        logger.info("Profiler %s (handler=%s, chat_id=%s)", "enabled" if enabled else "disabled", handler, chat_id)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+
+    def begin(self, handler, chat_id):
+        if not self.enabled:
+            return False
+        if self.handler is not None and handler != self.handler:
+            return False
+        if self.chat_id is not None and chat_id != self.chat_id:
+            return False
+        ident = threading.get_ident()
+        with self._lock:
+            label, depth = self._active.get(ident, (handler, 0))
+            self._active[ident] = (label, depth + 1)
+        self._wakeup.set()
+        return True
+
+    def end(self):
+        ident = threading.get_ident()
+        with self._lock:
+            label, depth = self._active.get(ident, (None, 1))
+            if depth <= 1:
+                self._active.pop(ident, None)
+            else:
+                self._active[ident] = (label, depth - 1)
+
+    def collapsed(self):
+        with self._lock:
+            items = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in items)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wakeup.wait(1)
+                self._wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            for ident, (label, _) in active.items():
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join([label] + stack[::-1])
+                with self._lock:
+                    if key in self.samples or len(self.samples) < self.max_stacks:
+                        self.samples[key] += 1
+            time.sleep(self.interval)
+
+
+profiler = SamplingProfiler()
+
+
+# ==========================
+# HTTP-эндпоинт
+# ==========================
+class MetricsServer(ThreadingHTTPServer):
+    """GET /metrics — метрики; /profile — управление профилировщиком:
+    /profile?handler=show_statistics&chat_id=42 включает, /profile?off=1 выключает,
+    /profile?reset=1 очищает выборку, /profile без параметров отдаёт свёрнутые стеки.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, registry=REGISTRY):
+        super().__init__(address, _MetricsHandler)
+        self.registry = registry
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, text, content_type="text/plain; version=0.0.4; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            self._reply(200, self.server.registry.render())
+        elif url.path == "/profile":
+            params = dict(parse_qsl(url.query))
+            chat_id = params.get("chat_id")
+            try:
+                chat_id = int(chat_id) if chat_id else None
+            except ValueError:
+                self._reply(400, "chat_id must be an integer\n")
+                return
+            if "off" in params:
+                profiler.configure(enabled=False)
+            if "reset" in params:
+                profiler.reset()
+            if "handler" in params or "chat_id" in params:
+                profiler.configure(params.get("handler"), chat_id)
+            self._reply(200, profiler.collapsed(), "text/plain; charset=utf-8")
+        else:
+            self._reply(404, "not found\n")
+
+
+def start_server(host="127.0.0.1", port=9108):
+    """Запускает /metrics в фоновом потоке. None, если порт занят (бот при этом работает дальше)."""
+    try:
+        server = MetricsServer((host, port))
+    except OSError as e:
+        logger.warning("Metrics endpoint disabled: cannot listen on %s:%s (%s)", host, port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics endpoint on http://%s:%s/metrics", host, server.server_port)
+    return server
@@ -0,0 +1,354 @@
+import logging
+
+import stats
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Версионированные миграции схемы tasks.db
+# ==========================
+# Текущая версия схемы хранится в PRAGMA user_version. Миграция с номером N
+# переводит базу из версии N-1 в версию N; при старте применяются все недостающие
+# миграции по порядку, каждая в своей транзакции.
+MIGRATIONS = []
+# Сколько строк (категорий и задач) миграция 5 готова создать, копируя общие категории
+# каждому известному чату; при большем объёме они достаются первому обратившемуся чату
+SHARED_COPY_LIMIT = 100_000
+
+
+def migration(func):
+    MIGRATIONS.append(func)
+    return func
+
+
+@migration
+def create_base_tables(cursor):
+    """Исходная схема (для уже существующих баз ничего не меняет)."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER,
+            name TEXT NOT NULL,
+            total_time INTEGER DEFAULT 0,
+            FOREIGN KEY(category_id) REFERENCES categories(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS current_task (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            task_id INTEGER,
+            start_time INTEGER,
+            saved_time INTEGER DEFAULT 0,
+            FOREIGN KEY(task_id) REFERENCES tasks(id)
+        )
+    ''')
+
+
+@migration
+def add_indexes_and_cascades(cursor):
+    """Индексы для горячих выборок, UNIQUE(current_task.chat_id) и ON DELETE CASCADE."""
+    # SQLite не умеет менять ограничения существующей таблицы — пересоздаём tasks и current_task.
+    cursor.execute('''
+        CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category_id INTEGER,
+            name TEXT NOT NULL,
+            total_time INTEGER DEFAULT 0,
+            FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO tasks_new (id, category_id, name, total_time)
+        SELECT id, CASE WHEN category_id IN (SELECT id FROM categories) THEN category_id END, name, total_time
+        FROM tasks
+    ''')
+    cursor.execute("DROP TABLE tasks")
+    cursor.execute("ALTER TABLE tasks_new RENAME TO tasks")
+    cursor.execute("CREATE INDEX idx_tasks_category_id ON tasks(category_id)")
+
+    cursor.execute('''
+        CREATE TABLE current_task_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL UNIQUE,
+            task_id INTEGER,
+            start_time INTEGER,
+            saved_time INTEGER DEFAULT 0,
+            FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE
+        )
+    ''')
+    # Раньше на один чат могло остаться несколько строк — оставляем самую свежую
+    cursor.execute('''
+        INSERT INTO current_task_new (id, chat_id, task_id, start_time, saved_time)
+        SELECT id, chat_id, task_id, start_time, saved_time FROM current_task
+        WHERE id IN (SELECT MAX(id) FROM current_task WHERE chat_id IS NOT NULL GROUP BY chat_id)
+          AND task_id IN (SELECT id FROM tasks)
+    ''')
+    cursor.execute("DROP TABLE current_task")
+    cursor.execute("ALTER TABLE current_task_new RENAME TO current_task")
+
+
+@migration
+def add_time_entries_and_rollups(cursor):
+    """Журнал отрезков времени и агрегаты по категориям и дням, обновляемые при каждой записи."""
+    cursor.execute('''
+        CREATE TABLE time_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            start INTEGER NOT NULL,
+            end INTEGER NOT NULL,
+            FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX idx_time_entries_task_id ON time_entries(task_id)")
+    cursor.execute("CREATE INDEX idx_time_entries_chat_start ON time_entries(chat_id, start)")
+    cursor.execute('''
+        CREATE TABLE category_rollup (
+            category_id INTEGER PRIMARY KEY,
+            total_time INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE daily_rollup (
+            category_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            total_time INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(category_id, day, task_id),
+            FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE CASCADE,
+            FOREIGN KEY(task_id) REFERENCES tasks(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX idx_daily_rollup_task_id ON daily_rollup(task_id)")
+    # Накопленное до появления журнала время переносим в агрегат по категориям
+    cursor.execute('''
+        INSERT INTO category_rollup (category_id, total_time)
+        SELECT c.id, COALESCE(SUM(t.total_time), 0)
+        FROM categories c
+        LEFT JOIN tasks t ON c.id = t.category_id
+        GROUP BY c.id
+    ''')
+
+
+@migration
+def add_chat_sessions(cursor):
+    """Основное сообщение и состояние ввода чата, чтобы они переживали перезапуск бота."""
+    cursor.execute('''
+        CREATE TABLE chat_sessions (
+            chat_id INTEGER PRIMARY KEY,
+            main_message_id INTEGER,
+            user_state TEXT
+        )
+    ''')
+
+
+@migration
+def add_owner_chat_id(cursor):
+    """Владелец (chat_id) у категорий и задач и составные индексы для постраничных выборок.
+
+    Прежние категории были общими. Каждая отдаётся чату, записавшему по её задачам больше
+    всего времени, а без журнала (обновление с исходной схемы) — чату, у которого в ней
+    запущена задача. Остальные категории видели все чаты: они копируются каждому известному
+    чату (см. _share_unowned_categories). Чаты, работавшие в чужой категории, получают
+    собственную копию с теми задачами, которыми пользовались (см. _split_shared_categories),
+    так что их время остаётся у них. Если не известен ни один чат или копий вышло бы больше
+    SHARED_COPY_LIMIT строк, категории остаются без владельца до первого обращения к боту
+    (см. tracker.claim_unowned).
+    """
+    cursor.execute("ALTER TABLE categories ADD COLUMN chat_id INTEGER")
+    cursor.execute("ALTER TABLE tasks ADD COLUMN chat_id INTEGER")
+    cursor.execute('''
+        UPDATE categories SET chat_id = (
+            SELECT te.chat_id
+            FROM time_entries te
+            JOIN tasks t ON t.id = te.task_id
+            WHERE t.category_id = categories.id
+            GROUP BY te.chat_id
+            ORDER BY SUM(te.end - te.start) DESC
+            LIMIT 1
+        )
+    ''')
+    cursor.execute('''
+        UPDATE categories SET chat_id = (
+            SELECT MIN(ct.chat_id)
+            FROM current_task ct
+            JOIN tasks t ON t.id = ct.task_id
+            WHERE t.category_id = categories.id
+        )
+        WHERE chat_id IS NULL
+    ''')
+    cursor.execute("UPDATE tasks SET chat_id = (SELECT chat_id FROM categories WHERE id = tasks.category_id)")
+    cursor.execute('''
+        SELECT chat_id FROM time_entries
+        UNION SELECT chat_id FROM current_task
+        UNION SELECT chat_id FROM chat_sessions
+        ORDER BY chat_id
+    ''')
+    chats = [row[0] for row in cursor.fetchall()]
+    shared = _share_unowned_categories(cursor, chats)
+    if shared:
+        logger.info("Gave %s unowned categories to each of %s known chats", shared, len(chats))
+    copies = _split_shared_categories(cursor)
+    if copies:
+        logger.info("Moved other chats' time out of %s shared categories into their own copies", copies)
+    cursor.execute("SELECT COUNT(*) FROM categories WHERE chat_id IS NULL")
+    orphaned = cursor.fetchone()[0]
+    if orphaned:
+        logger.warning("%s categories have no owner: the first chat that opens them gets them", orphaned)
+    # Keyset-выборки: WHERE chat_id = ? [AND category_id = ?] AND id > ? ORDER BY id LIMIT n
+    cursor.execute("CREATE INDEX idx_categories_chat_id ON categories(chat_id, id)")
+    cursor.execute("CREATE INDEX idx_tasks_chat_category ON tasks(chat_id, category_id, id)")
+
+
+def _share_unowned_categories(cursor, chats):
+    """Категории без владельца: оригинал отдаётся первому из chats, остальным чатам — копии.
+
+    Копия получает те же задачи, tasks.total_time и category_rollup: время, накопленное до
+    журнала, к чату не отнести, а до миграции каждый чат видел его целиком. Отрезков журнала
+    (и daily_rollup) у таких категорий нет — иначе владелец нашёлся бы по ним.
+    Возвращает число таких категорий (0, если чатов нет или копий больше SHARED_COPY_LIMIT).
+    """
+    if not chats:
+        return 0
+    cursor.execute("SELECT id FROM categories WHERE chat_id IS NULL")
+    categories = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT COUNT(*) FROM tasks WHERE category_id IN (SELECT id FROM categories WHERE chat_id IS NULL)")
+    copied_rows = (len(categories) + cursor.fetchone()[0]) * (len(chats) - 1)
+    if copied_rows > SHARED_COPY_LIMIT:
+        logger.warning("Not copying %s unowned categories to %s chats (%s rows)", len(categories), len(chats), copied_rows)
+        return 0
+    for category_id in categories:
+        for chat_id in chats[1:]:
+            cursor.execute("INSERT INTO categories (name, chat_id) SELECT name, ? FROM categories WHERE id = ?",
+                           (chat_id, category_id))
+            copy_id = cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO tasks (category_id, name, total_time, chat_id)
+                SELECT ?, name, total_time, ? FROM tasks WHERE category_id = ? ORDER BY id
+            ''', (copy_id, chat_id, category_id))
+            cursor.execute('''
+                INSERT INTO category_rollup (category_id, total_time)
+                SELECT ?, total_time FROM category_rollup WHERE category_id = ?
+            ''', (copy_id, category_id))
+        cursor.execute("UPDATE categories SET chat_id = ? WHERE id = ?", (chats[0], category_id))
+        cursor.execute("UPDATE tasks SET chat_id = ? WHERE category_id = ?", (chats[0], category_id))
+    return len(categories)
+
+
+def _split_shared_categories(cursor):
+    """Время (и запущенная задача) чата в категории другого владельца переносится в копию категории.
+
+    Для каждой пары (категория, чужой чат) создаётся категория чата с тем же названием и
+    копиями использованных задач; отрезки журнала и current_task перевешиваются на копии,
+    а tasks.total_time, category_rollup и daily_rollup пересчитываются. Время, накопленное
+    до появления журнала, отнести к чату нельзя — оно остаётся у владельца.
+    Возвращает число созданных копий категорий.
+    """
+    cursor.execute('''
+        SELECT t.category_id, te.chat_id
+        FROM time_entries te
+        JOIN tasks t ON t.id = te.task_id
+        JOIN categories c ON c.id = t.category_id
+        WHERE te.chat_id IS NOT c.chat_id
+        UNION
+        SELECT t.category_id, ct.chat_id
+        FROM current_task ct
+        JOIN tasks t ON t.id = ct.task_id
+        JOIN categories c ON c.id = t.category_id
+        WHERE ct.chat_id IS NOT c.chat_id
+    ''')
+    shares = cursor.fetchall()
+    for category_id, chat_id in shares:
+        cursor.execute("INSERT INTO categories (name, chat_id) SELECT name, ? FROM categories WHERE id = ?",
+                       (chat_id, category_id))
+        copy_id = cursor.lastrowid
+        cursor.execute('''
+            SELECT id, name FROM tasks
+            WHERE category_id = ? AND id IN (
+                SELECT task_id FROM time_entries WHERE chat_id = ?
+                UNION SELECT task_id FROM current_task WHERE chat_id = ?
+            )
+        ''', (category_id, chat_id, chat_id))
+        moved_total = 0
+        for task_id, name in cursor.fetchall():
+            cursor.execute("SELECT COALESCE(SUM(MAX(end - start, 0)), 0) FROM time_entries WHERE task_id = ? AND chat_id = ?",
+                           (task_id, chat_id))
+            moved = cursor.fetchone()[0]
+            cursor.execute("INSERT INTO tasks (category_id, name, total_time, chat_id) VALUES (?, ?, ?, ?)",
+                           (copy_id, name, moved, chat_id))
+            copy_task_id = cursor.lastrowid
+            cursor.execute("UPDATE time_entries SET task_id = ? WHERE task_id = ? AND chat_id = ?",
+                           (copy_task_id, task_id, chat_id))
+            cursor.execute("UPDATE current_task SET task_id = ? WHERE task_id = ? AND chat_id = ?",
+                           (copy_task_id, task_id, chat_id))
+            cursor.execute("UPDATE tasks SET total_time = total_time - ? WHERE id = ?", (moved, task_id))
+            _rebuild_daily_rollup(cursor, task_id)
+            _rebuild_daily_rollup(cursor, copy_task_id)
+            moved_total += moved
+        cursor.execute("UPDATE category_rollup SET total_time = total_time - ? WHERE category_id = ?",
+                       (moved_total, category_id))
+        cursor.execute("INSERT INTO category_rollup (category_id, total_time) VALUES (?, ?)", (copy_id, moved_total))
+    return len(shares)
+
+
+def _rebuild_daily_rollup(cursor, task_id):
+    """Пересчитывает daily_rollup задачи по её отрезкам в time_entries."""
+    cursor.execute("DELETE FROM daily_rollup WHERE task_id = ?", (task_id,))
+    cursor.execute('''
+        SELECT t.category_id, te.start, te.end
+        FROM time_entries te
+        JOIN tasks t ON t.id = te.task_id
+        WHERE te.task_id = ?
+    ''', (task_id,))
+    daily = {}
+    for category_id, start, end in cursor.fetchall():
+        for day, seconds in stats.split_by_day(start, end):
+            daily[(category_id, day)] = daily.get((category_id, day), 0) + seconds
+    cursor.executemany("INSERT INTO daily_rollup (category_id, day, task_id, total_time) VALUES (?, ?, ?, ?)",
+                       [(category_id, day, task_id, seconds) for (category_id, day), seconds in daily.items()])
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Применяет недостающие миграции до версии target (по умолчанию — до последней).
+
+    Соединение должно быть в режиме autocommit (isolation_level=None), как в db.connect().
+    """
+    target = len(MIGRATIONS) if target is None else target
+    version = get_version(conn)
+    if version >= target:
+        return version
+    # Пересоздание таблиц требует выключенных внешних ключей; pragma не действует внутри транзакции
+    fk_enabled = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for number in range(version + 1, target + 1):
+            func = MIGRATIONS[number - 1]
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                func(cursor)
+                violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+                if violations:
+                    raise RuntimeError(f"Migration {number} left foreign key violations: {violations[:5]}")
+                cursor.execute(f"PRAGMA user_version = {number}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            logger.info("Applied migration %s (%s)", number, func.__name__)
+    finally:
+        if fk_enabled:
+            conn.execute("PRAGMA foreign_keys=ON")
+    return target
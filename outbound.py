@@ -0,0 +1,502 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Исходящие запросы к Telegram с ограничением скорости
+# ==========================
+# Telegram допускает около 30 сообщений в секунду суммарно и около одного в секунду
+# на чат. Все исходящие вызовы проходят через общий token bucket и bucket своего чата,
+# ответ 429 с retry_after откладывает чат на указанное время. Правки сообщений ставятся в
+# очередь: повторные правки того же сообщения схлопываются до последнего текста,
+# а правка, совпадающая с уже отправленной, не отправляется вовсе.
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Сколько ждать до появления токена (0 — токен есть)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimits:
+    """Общий bucket, bucket'ы чатов и паузы после 429. Синхронизацию обеспечивает вызывающий."""
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}                  # chat_id -> TokenBucket
+        self._blocked_until = {}          # chat_id -> monotonic-время окончания retry_after
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                for idle in [cid for cid, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[idle]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def delay(self, chat_id, now):
+        """Сколько ждать до отправки в чат (0 — можно сейчас)."""
+        blocked = self._blocked_until.get(chat_id, 0.0) - now
+        if blocked > 0:
+            return blocked
+        return max(self._chat_bucket(chat_id, now).delay(now), self._global.delay(now))
+
+    def take(self, chat_id, now):
+        self._chat_bucket(chat_id, now).take(now)
+        self._global.take(now)
+
+    def block(self, chat_id, seconds, now):
+        until = now + seconds
+        self._blocked_until[chat_id] = max(self._blocked_until.get(chat_id, 0.0), until)
+        if len(self._blocked_until) > self.MAX_CHAT_BUCKETS:
+            for cid in [cid for cid, t in self._blocked_until.items() if t <= now]:
+                del self._blocked_until[cid]
+
+
+def retry_after(error):
+    """retry_after из ответа 429 (ApiTelegramException) или None для прочих ошибок."""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result = getattr(error, "result_json", None) or {}
+    return (result.get("parameters") or {}).get("retry_after", 1)
+
+
+# Ответы 400, после которых правка бессмысленна: сообщение удалено или стало нередактируемым
+LOST_MESSAGE_ERRORS = ("message to edit not found", "message can't be edited")
+
+
+def message_lost(error):
+    """True, если правка не удалась, потому что сообщения больше нет (или его нельзя править)."""
+    if getattr(error, "error_code", None) != 400:
+        return False
+    description = str(getattr(error, "description", None) or error).lower()
+    return any(text in description for text in LOST_MESSAGE_ERRORS)
+
+
+# Второй элемент ключа очереди для вызовов send (у правок там message_id)
+_SEND = None
+
+
+def _markup_key(reply_markup):
+    if reply_markup is None:
+        return None
+    to_json = getattr(reply_markup, "to_json", None)
+    return to_json() if to_json else repr(reply_markup)
+
+
+class Outbox:
+    """Диспетчер исходящих вызовов бота.
+
+    ``edit`` — неблокирующая правка сообщения через очередь с объединением;
+    ``send`` — неблокирующий вызов API (отправка, удаление) через ту же очередь,
+    по порядку внутри чата; результат передаётся в callback из потока очереди;
+    ``call`` — синхронный вызов API, который ждёт токенов и повторяет запрос после 429.
+    Потоки обработки обновлений пользуются ``edit`` и ``send``: ожидание лимитов одного
+    чата не должно задерживать другие чаты той же полосы.
+
+    Если править уже нечего (сообщение удалено), очередь забывает его и вызывает
+    ``on_lost(chat_id, message_id, text, reply_markup)`` в отдельном потоке: замена
+    сообщения ждёт лимитов своего чата, а правки остальных чатов идут дальше.
+    """
+
+    MAX_REMEMBERED = 10000
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3):
+        self.bot = bot
+        self.max_retries = max_retries
+        self._cond = threading.Condition()
+        self._limits = RateLimits(global_rate, chat_rate, chat_burst)
+        self._pending = {}                # (chat_id, message_id) -> (text, reply_markup)
+        self._calls = {}                  # chat_id -> deque вызовов send, ключ очереди (chat_id, _SEND)
+        self._ready = deque()
+        self._delayed = []                # heap (время, seq, ключ)
+        self._seq = itertools.count()
+        self._last_sent = OrderedDict()   # (chat_id, message_id) -> (text, markup_json)
+        self.sent = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.throttled = 0
+        self.lost = 0
+        self.on_lost = None
+        # Поток создаётся при первой потере сообщения
+        self._lost_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox-lost")
+        self._worker = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._worker.start()
+
+    # --- общие ограничения ---
+
+    def _delay_locked(self, chat_id, now):
+        return self._limits.delay(chat_id, now)
+
+    def _take_locked(self, chat_id, now):
+        self._limits.take(chat_id, now)
+
+    def _throttle(self, chat_id, seconds):
+        with self._cond:
+            self.throttled += 1
+            self._limits.block(chat_id, seconds, time.monotonic())
+        logger.warning("Telegram rate limit for chat_id %s, retry after %s s", chat_id, seconds)
+
+    # --- синхронные вызовы ---
+
+    def call(self, chat_id, func, *args, **kwargs):
+        """Вызывает метод API с учётом лимитов и повторами после 429."""
+        for attempt in range(self.max_retries + 1):
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    wait = self._delay_locked(chat_id, now)
+                    if wait <= 0:
+                        self._take_locked(chat_id, now)
+                        break
+                    self._cond.wait(wait)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                seconds = retry_after(e)
+                if seconds is None or attempt == self.max_retries:
+                    raise
+                self._throttle(chat_id, seconds)
+
+    # --- очередь вызовов ---
+
+    def send(self, chat_id, func, *args, callback=None, **kwargs):
+        """Ставит вызов метода API в очередь (не блокирует).
+
+        Вызовы одного чата выполняются по порядку. callback(result) вызывается из потока
+        очереди и не должен блокировать; при ошибке ошибка пишется в лог, а result — None.
+        """
+        with self._cond:
+            calls = self._calls.get(chat_id)
+            if calls is None:
+                calls = self._calls[chat_id] = deque()
+                self._ready.append((chat_id, _SEND))
+            calls.append((func, args, kwargs, callback, 0))
+            self._cond.notify_all()
+
+    # --- очередь правок ---
+
+    def edit(self, chat_id, message_id, text, reply_markup=None):
+        """Ставит правку сообщения в очередь (не блокирует)."""
+        key = (chat_id, message_id)
+        with self._cond:
+            if self._last_sent.get(key) == (text, _markup_key(reply_markup)) and key not in self._pending:
+                self.skipped += 1
+                return
+            if key in self._pending:
+                self.coalesced += 1
+            else:
+                self._ready.append(key)
+            self._pending[key] = (text, reply_markup)
+            self._cond.notify_all()
+
+    def forget(self, chat_id, message_id):
+        """Сбрасывает очередь и память о последнем тексте сообщения (например, после удаления)."""
+        key = (chat_id, message_id)
+        with self._cond:
+            self._pending.pop(key, None)
+            self._last_sent.pop(key, None)
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending) + sum(len(calls) for calls in self._calls.values())
+
+    def stats(self):
+        return {"sent": self.sent, "calls": self.calls, "coalesced": self.coalesced, "skipped": self.skipped,
+                "throttled": self.throttled, "lost": self.lost, "queue_depth": self.queue_depth()}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key, payload = self._next_locked()
+            if key[1] is _SEND:
+                self._send_call(key[0], payload)
+            else:
+                self._send_edit(key, payload)
+
+    def _next_locked(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                self._ready.append(heapq.heappop(self._delayed)[2])
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            while self._ready:
+                key = self._ready.popleft()
+                if key[1] is not _SEND and key not in self._pending:
+                    continue  # правку отменили через forget
+                wait = self._delay_locked(key[0], now)
+                if wait > 0:
+                    heapq.heappush(self._delayed, (now + wait, next(self._seq), key))
+                    timeout = wait if timeout is None else min(timeout, wait)
+                    continue
+                self._take_locked(key[0], now)
+                if key[1] is not _SEND:
+                    return key, self._pending.pop(key)
+                calls = self._calls[key[0]]
+                payload = calls.popleft()
+                if calls:
+                    self._ready.append(key)  # следующий вызов чата — после других чатов
+                else:
+                    del self._calls[key[0]]
+                return key, payload
+            self._cond.wait(timeout)
+
+    def _send_call(self, chat_id, payload):
+        func, args, kwargs, callback, attempt = payload
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            seconds = retry_after(e)
+            if seconds is not None and attempt < self.max_retries:
+                self._throttle(chat_id, seconds)
+                with self._cond:
+                    # Повтор встаёт перед остальными вызовами чата, чтобы не нарушить порядок
+                    calls = self._calls.get(chat_id)
+                    if calls is None:
+                        calls = self._calls[chat_id] = deque()
+                        self._ready.append((chat_id, _SEND))
+                    calls.appendleft((func, args, kwargs, callback, attempt + 1))
+                    self._cond.notify_all()
+                return
+            logger.exception("Error calling %s: %s", getattr(func, "__name__", func), e)
+            result = None
+        else:
+            with self._cond:
+                self.calls += 1
+        if callback is not None:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.exception("Error in outbox callback: %s", e)
+
+    def _send_edit(self, key, payload):
+        chat_id, message_id = key
+        text, reply_markup = payload
+        markup_key = _markup_key(reply_markup)
+        if self._last_sent.get(key) == (text, markup_key):
+            with self._cond:
+                self.skipped += 1
+            return
+        try:
+            self.bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup)
+        except Exception as e:
+            if message_lost(e):
+                self._lost(chat_id, message_id, payload)
+                return
+            seconds = retry_after(e)
+            if seconds is None:
+                logger.exception("Error editing message: %s", e)
+                return
+            self._throttle(chat_id, seconds)
+            with self._cond:
+                # Возвращаем правку в очередь, если за это время не пришла более свежая
+                if key not in self._pending:
+                    self._pending[key] = payload
+                    heapq.heappush(self._delayed, (time.monotonic() + seconds, next(self._seq), key))
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self.sent += 1
+            self._last_sent[key] = (text, markup_key)
+            self._last_sent.move_to_end(key)
+            while len(self._last_sent) > self.MAX_REMEMBERED:
+                self._last_sent.popitem(last=False)
+
+    def _lost(self, chat_id, message_id, payload):
+        logger.warning("Message %s in chat_id %s is gone, edit dropped", message_id, chat_id)
+        self.forget(chat_id, message_id)
+        with self._cond:
+            self.lost += 1
+        if self.on_lost is not None:
+            self._lost_executor.submit(self._replace_lost, chat_id, message_id, payload)
+
+    def _replace_lost(self, chat_id, message_id, payload):
+        try:
+            self.on_lost(chat_id, message_id, *payload)
+        except Exception as e:
+            logger.exception("Error replacing lost message: %s", e)
+
+
+class AsyncOutbox:
+    """То же для AsyncTeleBot: ожидание токенов через asyncio.sleep, правки — отдельными задачами.
+
+    ``send`` ставит вызовы чата в очередь, которую разбирает своя задача, — обработчик
+    не ждёт лимитов. ``on_lost`` здесь — корутина с теми же аргументами.
+    """
+
+    MAX_REMEMBERED = 10000
+
+    def __init__(self, bot, global_rate=30, chat_rate=1, chat_burst=3, max_retries=3):
+        self.bot = bot
+        self.max_retries = max_retries
+        self._limits = RateLimits(global_rate, chat_rate, chat_burst)
+        self._pending = {}                # (chat_id, message_id) -> (text, reply_markup)
+        self._flushing = set()
+        self._calls = {}                  # chat_id -> deque вызовов send
+        self._last_sent = OrderedDict()
+        self.sent = 0
+        self.calls = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.throttled = 0
+        self.lost = 0
+        self.on_lost = None
+
+    async def _acquire(self, chat_id):
+        while True:
+            now = time.monotonic()
+            wait = self._limits.delay(chat_id, now)
+            if wait <= 0:
+                self._limits.take(chat_id, now)
+                return
+            await asyncio.sleep(wait)
+
+    async def call(self, chat_id, func, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                seconds = retry_after(e)
+                if seconds is None or attempt == self.max_retries:
+                    raise
+                self.throttled += 1
+                self._limits.block(chat_id, seconds, time.monotonic())
+                logger.warning("Telegram rate limit for chat_id %s, retry after %s s", chat_id, seconds)
+
+    def send(self, chat_id, func, *args, callback=None, **kwargs):
+        """Ставит вызов в очередь чата (не ждёт); callback(result) — как у Outbox.send."""
+        calls = self._calls.get(chat_id)
+        if calls is None:
+            calls = self._calls[chat_id] = deque()
+            asyncio.get_running_loop().create_task(self._send_calls(chat_id, calls))
+        calls.append((func, args, kwargs, callback))
+
+    async def _send_calls(self, chat_id, calls):
+        try:
+            while calls:
+                # Вызов остаётся в очереди, пока выполняется: новые send не запускают вторую задачу
+                func, args, kwargs, callback = calls[0]
+                try:
+                    result = await self.call(chat_id, func, *args, **kwargs)
+                except Exception as e:
+                    logger.exception("Error calling %s: %s", getattr(func, "__name__", func), e)
+                    result = None
+                else:
+                    self.calls += 1
+                calls.popleft()
+                if callback is not None:
+                    try:
+                        callback(result)
+                    except Exception as e:
+                        logger.exception("Error in outbox callback: %s", e)
+        finally:
+            self._calls.pop(chat_id, None)
+
+    def edit(self, chat_id, message_id, text, reply_markup=None):
+        key = (chat_id, message_id)
+        if self._last_sent.get(key) == (text, _markup_key(reply_markup)) and key not in self._pending:
+            self.skipped += 1
+            return
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = (text, reply_markup)
+        if key not in self._flushing:
+            self._flushing.add(key)
+            asyncio.get_running_loop().create_task(self._flush(key))
+
+    def forget(self, chat_id, message_id):
+        key = (chat_id, message_id)
+        self._pending.pop(key, None)
+        self._last_sent.pop(key, None)
+
+    def queue_depth(self):
+        return len(self._pending) + sum(len(calls) for calls in self._calls.values())
+
+    def stats(self):
+        return {"sent": self.sent, "calls": self.calls, "coalesced": self.coalesced, "skipped": self.skipped,
+                "throttled": self.throttled, "lost": self.lost, "queue_depth": self.queue_depth()}
+
+    async def _flush(self, key):
+        chat_id, message_id = key
+        try:
+            while key in self._pending:
+                await self._acquire(chat_id)
+                # За время ожидания текст мог обновиться — берём самый свежий
+                payload = self._pending.pop(key, None)
+                if payload is None:
+                    break
+                text, reply_markup = payload
+                markup_key = _markup_key(reply_markup)
+                if self._last_sent.get(key) == (text, markup_key):
+                    self.skipped += 1
+                    continue
+                try:
+                    await self.bot.edit_message_text(text, chat_id, message_id, reply_markup=reply_markup)
+                except Exception as e:
+                    if message_lost(e):
+                        await self._lost(chat_id, message_id, payload)
+                        break
+                    seconds = retry_after(e)
+                    if seconds is None:
+                        logger.exception("Error editing message: %s", e)
+                        continue
+                    self.throttled += 1
+                    self._limits.block(chat_id, seconds, time.monotonic())
+                    self._pending.setdefault(key, payload)
+                    continue
+                self.sent += 1
+                self._last_sent[key] = (text, markup_key)
+                self._last_sent.move_to_end(key)
+                while len(self._last_sent) > self.MAX_REMEMBERED:
+                    self._last_sent.popitem(last=False)
+        finally:
+            self._flushing.discard(key)
+
+    async def _lost(self, chat_id, message_id, payload):
+        logger.warning("Message %s in chat_id %s is gone, edit dropped", message_id, chat_id)
+        self.forget(chat_id, message_id)
+        self.lost += 1
+        if self.on_lost is None:
+            return
+        try:
+            await self.on_lost(chat_id, message_id, *payload)
+        except Exception as e:
+            logger.exception("Error replacing lost message: %s", e)
@@ -0,0 +1,122 @@
+import inspect
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Табличная маршрутизация обновлений
+# ==========================
+# callback_data разбирается один раз в (действие, аргументы) и диспетчеризуется поиском
+# в словаре, а текстовые сообщения — по таблице состояний user_states[chat_id]["state"].
+# Формат callback_data: "действие:арг1:арг2", числовые аргументы приводятся к int.
+# Зарегистрированные обработчики оборачиваются в metrics.timed (задержка, запросы к БД).
+SEPARATOR = ":"
+
+
+def encode(action, *args):
+    """Собирает callback_data (Telegram ограничивает её 64 байтами)."""
+    data = SEPARATOR.join((action, *map(str, args)))
+    if len(data.encode("utf-8")) > 64:
+        raise ValueError(f"callback_data too long: {data!r}")
+    return data
+
+
+def _convert(arg):
+    return int(arg) if arg.lstrip("-").isdigit() else arg
+
+
+def _arity(func):
+    """(минимум, максимум) аргументов обработчика после call; максимум None — есть *args."""
+    params = list(inspect.signature(func).parameters.values())[1:]
+    positional = [p for p in params if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    required = sum(1 for p in positional if p.default is p.empty)
+    if any(p.kind is p.VAR_POSITIONAL for p in params):
+        return required, None
+    return required, len(positional)
+
+
+class Router:
+    def __init__(self, instrument=True):
+        """instrument=False регистрирует обработчики без metrics.timed (например, в бенчмарке диспетчеризации)."""
+        self._callbacks = {}    # действие -> обработчик(call, *args)
+        self._arities = {}      # действие -> (минимум, максимум) аргументов
+        self._states = {}       # состояние -> обработчик(message)
+        self._instrument = instrument
+
+    def _wrap(self, func):
+        return metrics.timed(func) if self._instrument else func
+
+    def callback(self, action):
+        def decorator(func):
+            self._callbacks[action] = self._wrap(func)
+            self._arities[action] = _arity(func)
+            return func
+        return decorator
+
+    def state(self, name):
+        def decorator(func):
+            self._states[name] = self._wrap(func)
+            return func
+        return decorator
+
+    @property
+    def actions(self):
+        return tuple(self._callbacks)
+
+    def parse(self, data):
+        """callback_data -> (действие, аргументы) или (None, ()) для неизвестных данных.
+
+        Понимает и старый формат "действие_id" с кнопок, отправленных до перехода на роутер.
+        Данные с числом аргументов, которого обработчик не принимает, тоже считаются
+        неизвестными: вызов упал бы с TypeError, и нажатие осталось бы без ответа.
+        """
+        if SEPARATOR in data:
+            action, *args = data.split(SEPARATOR)
+        elif data in self._callbacks:
+            action, args = data, []
+        else:
+            action, args = self._parse_legacy(data)
+        if action not in self._callbacks:
+            return None, ()
+        low, high = self._arities[action]
+        if len(args) < low or (high is not None and len(args) > high):
+            return None, ()
+        return action, tuple(_convert(arg) for arg in args)
+
+    def _parse_legacy(self, data):
+        index = data.find("_")
+        while index != -1:
+            if data[:index] in self._callbacks:
+                return data[:index], [data[index + 1:]]
+            index = data.find("_", index + 1)
+        return None, []
+
+    def match_callback(self, data):
+        """(обработчик, аргументы) для callback_data или (None, ())."""
+        action, args = self.parse(data or "")
+        if action is None:
+            logger.warning("Unknown or malformed callback data: %r", data)
+            return None, ()
+        return self._callbacks[action], args
+
+    def dispatch_callback(self, call):
+        handler, args = self.match_callback(call.data)
+        if handler is None:
+            return False
+        handler(call, *args)
+        return True
+
+    def has_state(self, state):
+        return state in self._states
+
+    def match_state(self, state):
+        return self._states.get(state)
+
+    def dispatch_message(self, message, state):
+        handler = self._states.get(state)
+        if handler is None:
+            return False
+        handler(message)
+        return True
@@ -0,0 +1,145 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("key", "callback", "interval", "due", "seq", "cancelled", "running")
+
+    def __init__(self, key, callback, interval, due, seq):
+        self.key = key
+        self.callback = callback
+        self.interval = interval
+        self.due = due
+        self.seq = seq
+        self.cancelled = False
+        self.running = False
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+class TickScheduler:
+    """Общий планировщик периодических задач: куча по времени следующего срабатывания,
+    один поток-диспетчер и небольшой пул исполнителей.
+
+    Колбэк вызывается со своей записью каждые ``interval`` секунд, пока его не отменят
+    через ``cancel`` или пока он сам не вернёт ``False``. Для одного ключа колбэки не
+    перекрываются: следующее срабатывание планируется только после завершения предыдущего.
+    """
+
+    def __init__(self, interval=10, workers=4, name="tick"):
+        self.interval = interval
+        self._heap = []
+        self._entries = {}        # key -> _Entry
+        self._stale = 0           # количество отменённых записей, ещё лежащих в куче
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._stopped = False
+        self._dispatcher = threading.Thread(target=self._run, name=f"{name}-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._cond:
+            return key in self._entries
+
+    def add(self, key, callback, interval=None, delay=None):
+        """Регистрирует (или заменяет) периодический колбэк для ключа. O(log n)."""
+        interval = self.interval if interval is None else interval
+        delay = interval if delay is None else delay
+        with self._cond:
+            self._cancel_locked(key)
+            entry = _Entry(key, callback, interval, time.monotonic() + delay, next(self._seq))
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return entry
+
+    def cancel(self, key):
+        """Отменяет колбэк для ключа, не дожидаясь выполняющегося срабатывания."""
+        with self._cond:
+            return self._cancel_locked(key)
+
+    def run_if_active(self, entry, func, *args):
+        """Вызывает func(*args), только если запись ещё не отменена. True, если вызвана.
+
+        Проверка и вызов идут под блокировкой планировщика, поэтому cancel() не может
+        вклиниться между ними: шаг, сделанный здесь, гарантированно предшествует отмене.
+        func должна быть короткой и неблокирующей.
+        """
+        with self._cond:
+            if entry.cancelled:
+                return False
+            func(*args)
+            return True
+
+    def shutdown(self, wait=False):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._pool.shutdown(wait=wait)
+
+    def _cancel_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry.cancelled = True
+        if entry.running:
+            return True
+        self._stale += 1
+        # Ленивое удаление: отменённые записи выбрасываются при извлечении,
+        # а при большом количестве мусора куча перестраивается целиком.
+        if self._stale > 64 and self._stale > len(self._heap) // 2:
+            self._heap = [e for e in self._heap if not e.cancelled]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                        self._stale -= 1
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0].due - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                entry = heapq.heappop(self._heap)
+                entry.running = True
+            self._pool.submit(self._fire, entry)
+
+    def _fire(self, entry):
+        keep = True
+        try:
+            keep = entry.callback(entry) is not False
+        except Exception as e:
+            logger.exception("Error in scheduled callback for %s: %s", entry.key, e)
+        with self._cond:
+            entry.running = False
+            if entry.cancelled:
+                return
+            if not keep:
+                self._entries.pop(entry.key, None)
+                entry.cancelled = True
+                return
+            entry.due = max(entry.due + entry.interval, time.monotonic())
+            entry.seq = next(self._seq)
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
@@ -0,0 +1,123 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Состояние чатов с отложенной записью
+# ==========================
+# main_messages и user_states живут в памяти (обработчики читают их на каждом обновлении),
+# а изменения пачкой сбрасываются в chat_sessions фоновым потоком раз в FLUSH_INTERVAL
+# секунд и при выходе. После перезапуска бот продолжает править то же сообщение.
+FLUSH_INTERVAL = 1.0
+
+_DELETED = object()
+
+
+class WriteBehindMap:
+    """dict chat_id -> значение, отражённый в столбец column таблицы chat_sessions."""
+
+    def __init__(self, column, encode=None, decode=None):
+        self.column = column
+        self._encode = encode or (lambda value: value)
+        self._decode = decode or (lambda value: value)
+        self._data = {}
+        self._dirty = {}          # chat_id -> новое значение или _DELETED
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Загружает сохранённые значения одним запросом (вызывается при старте)."""
+        with db.read() as cursor:
+            cursor.execute(f"SELECT chat_id, {self.column} FROM chat_sessions WHERE {self.column} IS NOT NULL")
+            rows = cursor.fetchall()
+        with self._lock:
+            for chat_id, value in rows:
+                self._data.setdefault(chat_id, self._decode(value))
+        return len(rows)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, chat_id):
+        return self._data[chat_id]
+
+    def get(self, chat_id, default=None):
+        return self._data.get(chat_id, default)
+
+    def __setitem__(self, chat_id, value):
+        with self._lock:
+            self._data[chat_id] = value
+            self._dirty[chat_id] = value
+
+    def __delitem__(self, chat_id):
+        with self._lock:
+            del self._data[chat_id]
+            self._dirty[chat_id] = _DELETED
+
+    def pop(self, chat_id, *default):
+        with self._lock:
+            if chat_id in self._data:
+                self._dirty[chat_id] = _DELETED
+            return self._data.pop(chat_id, *default)
+
+    @property
+    def pending(self):
+        return len(self._dirty)
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        updates = [(chat_id, self._encode(value)) for chat_id, value in dirty.items() if value is not _DELETED]
+        deletes = [(chat_id,) for chat_id, value in dirty.items() if value is _DELETED]
+        try:
+            with db.transaction() as cursor:
+                cursor.executemany(f'''
+                    INSERT INTO chat_sessions (chat_id, {self.column}) VALUES (?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET {self.column} = excluded.{self.column}
+                ''', updates)
+                cursor.executemany(f"UPDATE chat_sessions SET {self.column} = NULL WHERE chat_id = ?", deletes)
+                cursor.executemany('''
+                    DELETE FROM chat_sessions
+                    WHERE chat_id = ? AND main_message_id IS NULL AND user_state IS NULL
+                ''', deletes)
+        except Exception as e:
+            logger.exception("Error flushing %s: %s", self.column, e)
+            with self._lock:
+                # Вернём несохранённое, не затирая то, что успели изменить за это время
+                for chat_id, value in dirty.items():
+                    self._dirty.setdefault(chat_id, value)
+            return 0
+        return len(dirty)
+
+
+def start_flusher(maps, interval=FLUSH_INTERVAL):
+    """Запускает фоновый сброс изменений и финальный сброс при выходе из процесса."""
+    def flush_all():
+        for store in maps:
+            store.flush()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush_all()
+
+    thread = threading.Thread(target=run, name="session-flusher", daemon=True)
+    thread.start()
+    atexit.register(flush_all)
+    return thread
+
+
+def json_map(column):
+    """WriteBehindMap для значений-словарей, хранящихся в JSON."""
+    return WriteBehindMap(column, encode=lambda value: json.dumps(value, ensure_ascii=False), decode=json.loads)
@@ -0,0 +1,183 @@
+import time
+from datetime import date, timedelta
+
+# ==========================
+# Журнал времени и агрегаты для статистики
+# ==========================
+# Каждый остановленный таймер превращается в строку time_entries. В той же транзакции
+# обновляются tasks.total_time, category_rollup (итог по категории) и daily_rollup
+# (итог по категории/дню/задаче), так что статистика читает готовые суммы.
+
+
+def day_key(timestamp):
+    """Локальная дата отметки времени в виде 'ГГГГ-ММ-ДД'."""
+    return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+
+def split_by_day(start, end):
+    """Разбивает отрезок [start, end) по границам локальных суток: [(день, секунды), ...]."""
+    parts = []
+    while start < end:
+        tm = time.localtime(start)
+        next_midnight = int(time.mktime((tm.tm_year, tm.tm_mon, tm.tm_mday + 1, 0, 0, 0, 0, 0, -1)))
+        chunk_end = min(end, next_midnight)
+        parts.append((day_key(start), chunk_end - start))
+        start = chunk_end
+    return parts
+
+
+def record_entry(cursor, chat_id, task_id, start, end):
+    """Записывает отрезок работы над задачей и обновляет все агрегаты. Возвращает длительность."""
+    total = max(0, end - start)
+    cursor.execute("INSERT INTO time_entries (task_id, chat_id, start, end) VALUES (?, ?, ?, ?)",
+                   (task_id, chat_id, start, end))
+    cursor.execute("UPDATE tasks SET total_time = total_time + ? WHERE id = ?", (total, task_id))
+    cursor.execute("SELECT category_id FROM tasks WHERE id = ?", (task_id,))
+    row = cursor.fetchone()
+    category_id = row[0] if row else None
+    if category_id is None:
+        return total
+    cursor.execute('''
+        INSERT INTO category_rollup (category_id, total_time) VALUES (?, ?)
+        ON CONFLICT(category_id) DO UPDATE SET total_time = total_time + excluded.total_time
+    ''', (category_id, total))
+    cursor.executemany('''
+        INSERT INTO daily_rollup (category_id, day, task_id, total_time) VALUES (?, ?, ?, ?)
+        ON CONFLICT(category_id, day, task_id) DO UPDATE SET total_time = total_time + excluded.total_time
+    ''', [(category_id, day, task_id, seconds) for day, seconds in split_by_day(start, end)])
+    return total
+
+
+def record_entries(cursor, chat_id, entries):
+    """Пакетный record_entry для импорта: entries — [(task_id, category_id, start, end), ...].
+
+    Строки журнала вставляются одним executemany, а суммы копятся в памяти и
+    записываются одним UPSERT на задачу, категорию и (категория, день, задача).
+    """
+    cursor.executemany("INSERT INTO time_entries (task_id, chat_id, start, end) VALUES (?, ?, ?, ?)",
+                       ((task_id, chat_id, start, end) for task_id, _, start, end in entries))
+    task_time, category_time, daily = {}, {}, {}
+    for task_id, category_id, start, end in entries:
+        total = max(0, end - start)
+        task_time[task_id] = task_time.get(task_id, 0) + total
+        category_time[category_id] = category_time.get(category_id, 0) + total
+        for day, seconds in split_by_day(start, end):
+            key = (category_id, day, task_id)
+            daily[key] = daily.get(key, 0) + seconds
+    add_totals(cursor, task_time, category_time)
+    cursor.executemany('''
+        INSERT INTO daily_rollup (category_id, day, task_id, total_time) VALUES (?, ?, ?, ?)
+        ON CONFLICT(category_id, day, task_id) DO UPDATE SET total_time = total_time + excluded.total_time
+    ''', [(*key, seconds) for key, seconds in daily.items()])
+
+
+def add_totals(cursor, task_time, category_time):
+    """Прибавляет {task_id: секунды} к tasks.total_time и {category_id: секунды} к category_rollup."""
+    cursor.executemany("UPDATE tasks SET total_time = total_time + ? WHERE id = ?",
+                       [(seconds, task_id) for task_id, seconds in task_time.items()])
+    cursor.executemany('''
+        INSERT INTO category_rollup (category_id, total_time) VALUES (?, ?)
+        ON CONFLICT(category_id) DO UPDATE SET total_time = total_time + excluded.total_time
+    ''', list(category_time.items()))
+
+
+def category_totals(cursor, chat_id):
+    """Итоговое время по категориям чата: [(название, секунды), ...]."""
+    cursor.execute('''
+        SELECT c.name, COALESCE(r.total_time, 0)
+        FROM categories c
+        LEFT JOIN category_rollup r ON r.category_id = c.id
+        WHERE c.chat_id = ?
+        ORDER BY c.id
+    ''', (chat_id,))
+    return cursor.fetchall()
+
+
+# ==========================
+# Статистика за период (по дневным агрегатам)
+# ==========================
+RANGE_LABELS = {
+    "today": "сегодня",
+    "week": "эту неделю",
+    "month": "этот месяц",
+}
+
+
+def parse_range(text, now=None):
+    """Разбирает период: today | week | month | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД] (или через '..').
+
+    Возвращает (подпись, первый_день, последний_день) либо None, если период не распознан.
+    """
+    now = int(time.time()) if now is None else now
+    text = (text or "today").strip().lower()
+    tm = time.localtime(now)
+    today = day_key(now)
+    if text == "today":
+        return RANGE_LABELS[text], today, today
+    if text == "week":
+        # Календарная дата, а не now - N суток: неделя с переходом на летнее/зимнее время короче
+        # или длиннее 7 * 86400 секунд, и вычитание попадало бы в соседний день
+        monday = date.fromtimestamp(now) - timedelta(days=tm.tm_wday)
+        return RANGE_LABELS[text], monday.isoformat(), today
+    if text == "month":
+        return RANGE_LABELS[text], time.strftime("%Y-%m-01", tm), today
+    parts = text.replace("..", " ").split()
+    if len(parts) not in (1, 2):
+        return None
+    try:
+        days = [time.strftime("%Y-%m-%d", time.strptime(part, "%Y-%m-%d")) for part in parts]
+    except ValueError:
+        return None
+    first, last = days[0], days[-1]
+    if first > last:
+        first, last = last, first
+    label = first if first == last else f"{first} — {last}"
+    return label, first, last
+
+
+def range_totals(cursor, chat_id, first_day, last_day):
+    """Время по задачам категорий чата за период [first_day, last_day]: [(категория, задача, секунды), ...].
+
+    Для каждой категории читается только диапазон дней по первичному ключу
+    (category_id, day, task_id), то есть не больше «дней × задач» строк.
+    """
+    cursor.execute('''
+        SELECT c.name, t.name, SUM(d.total_time)
+        FROM daily_rollup d
+        JOIN categories c ON c.id = d.category_id
+        JOIN tasks t ON t.id = d.task_id
+        WHERE d.category_id IN (SELECT id FROM categories WHERE chat_id = ?)
+          AND d.day BETWEEN ? AND ?
+        GROUP BY d.category_id, d.task_id
+        ORDER BY d.category_id, d.task_id
+    ''', (chat_id, first_day, last_day))
+    return cursor.fetchall()
+
+
+def inflight_totals(cursor, chat_id, first_day, last_day, now=None):
+    """Ещё не записанное время запущенной задачи чата, попадающее в период."""
+    now = int(time.time()) if now is None else now
+    cursor.execute('''
+        SELECT c.name, t.name, ct.start_time, ct.saved_time
+        FROM current_task ct
+        JOIN tasks t ON ct.task_id = t.id
+        JOIN categories c ON t.category_id = c.id
+        WHERE ct.chat_id = ?
+    ''', (chat_id,))
+    row = cursor.fetchone()
+    if not row:
+        return []
+    cat_name, task_name, start_time, saved_time = row
+    seconds = sum(part for day, part in split_by_day(start_time - saved_time, now)
+                  if first_day <= day <= last_day)
+    return [(cat_name, task_name, seconds)] if seconds else []
+
+
+def merge_totals(*row_lists):
+    """Складывает строки (категория, задача, секунды) в {категория: {задача: секунды}}."""
+    result = {}
+    for rows in row_lists:
+        for cat_name, task_name, seconds in rows:
+            tasks = result.setdefault(cat_name, {})
+            tasks[task_name] = tasks.get(task_name, 0) + seconds
+    return result
@@ -0,0 +1,90 @@
+"""Обновление исходной схемы tasks.db (версия 1) до последней версии: владельцы категорий.
+
+Запуск: python -m pytest tests (или python -m unittest discover tests)
+"""
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import config  # noqa: F401
+except ModuleNotFoundError:
+    sys.modules["config"] = types.ModuleType("config")
+
+import db
+import migrations
+import tracker
+
+
+class UpgradeFromBaselineTest(unittest.TestCase):
+    """База в исходной схеме: общие категории, журнала и chat_sessions ещё нет."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db.close_all()
+        db.DB_PATH = os.path.join(self.tmp.name, "tasks.db")
+        tracker.metadata_cache.clear()
+        tracker._unowned_checked = False
+        self.conn = db.get_connection()
+        migrations.migrate(self.conn, target=1)
+        self.conn.executemany("INSERT INTO categories (id, name) VALUES (?, ?)",
+                              [(1, "Work"), (2, "Home"), (3, "Study")])
+        self.conn.executemany("INSERT INTO tasks (id, category_id, name, total_time) VALUES (?, ?, ?, ?)",
+                              [(1, 1, "Code", 3600), (2, 2, "Cook", 600), (3, 3, "Read", 1200)])
+
+    def tearDown(self):
+        db.close_all()
+        self.tmp.cleanup()
+
+    def upgrade(self, running):
+        """running: [(chat_id, task_id)] — задачи, запущенные в момент обновления."""
+        self.conn.executemany("INSERT INTO current_task (chat_id, task_id, start_time) VALUES (?, ?, 0)", running)
+        migrations.migrate(self.conn)
+
+    def test_every_known_chat_keeps_shared_categories(self):
+        self.upgrade([(10, 1), (20, 2), (30, 1)])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM categories WHERE chat_id IS NULL").fetchone()[0], 0)
+        # Work и Home — у чатов с запущенной в них задачей, Study (ничья) — у каждого чата
+        self.assertEqual(tracker.category_totals(10), [("Work", 3600), ("Study", 1200)])
+        self.assertEqual(tracker.category_totals(20), [("Home", 600), ("Study", 1200)])
+        # Чат 30 работал в категории чата 10: у него своя копия с запущенной задачей
+        self.assertEqual(tracker.category_totals(30), [("Study", 1200), ("Work", 0)])
+        info = tracker.get_current_task_info(30)
+        self.assertEqual(info[1:3], ("Code", "Work"))
+        self.assertTrue(tracker.owns_task(30, info[0]))
+        for chat_id in (10, 20, 30):
+            rows, _, _ = tracker.category_page(chat_id)
+            for cat_id, _ in rows:
+                tasks, _, _ = tracker.task_page(chat_id, cat_id)
+                self.assertEqual(len(tasks), 1)
+
+    def test_single_running_chat_gets_everything(self):
+        self.upgrade([(10, 1)])
+        self.assertEqual(tracker.category_totals(10), [("Work", 3600), ("Home", 600), ("Study", 1200)])
+
+    def test_too_many_copies_leave_categories_to_first_chat(self):
+        limit = migrations.SHARED_COPY_LIMIT
+        migrations.SHARED_COPY_LIMIT = 1
+        try:
+            self.upgrade([(10, 1), (20, 2)])
+        finally:
+            migrations.SHARED_COPY_LIMIT = limit
+        self.assertEqual(tracker.category_totals(20), [("Home", 600), ("Study", 1200)])
+        self.assertEqual(tracker.category_totals(10), [("Work", 3600)])
+
+    def test_without_known_chats_first_chat_claims_categories(self):
+        self.upgrade([])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM categories WHERE chat_id IS NULL").fetchone()[0], 3)
+        rows, _, _ = tracker.category_page(10)
+        self.assertEqual([name for _, name in rows], ["Work", "Home", "Study"])
+        tasks, _, _ = tracker.task_page(10, 1)
+        self.assertEqual([name for _, name in tasks], ["Code"])
+        self.assertEqual(tracker.category_totals(20), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
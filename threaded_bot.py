@@ -0,0 +1,639 @@
+import telebot
+import io
+import json
+import os
+import signal
+import threading
+import logging
+import config
+import charts
+import db
+import metrics
+import migrations
+import sessions
+import tracker
+import transfer
+import views
+import webhook
+from concurrent.futures import ThreadPoolExecutor
+from lanes import UpdateLanes, DROP_FULL, update_chat_id, update_merge_key
+from outbound import Outbox
+from router import Router
+from scheduler import TickScheduler
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Потоковый движок (TeleBot)
+# ==========================
+# Обработчики выполняются в потоках полос обновлений (по порядку внутри чата),
+# таймеры обслуживает общий планировщик. Запуск: python bot.py (движок по умолчанию).
+
+# Инициализация бота
+router = Router()
+# Необязательный адрес Bot API (например, локальный сервер для тестов и бенчмарков)
+if getattr(config, "API_URL", None):
+    telebot.apihelper.API_URL = config.API_URL
+# Адрес скачивания файлов (/import) для того же локального сервера
+if getattr(config, "FILE_URL", None):
+    telebot.apihelper.FILE_URL = config.FILE_URL
+# threaded=False: обработчики вызываются в потоках полос (см. enqueue_updates ниже),
+# а не во внутреннем пуле telebot без гарантий порядка
+bot = telebot.TeleBot(config.TOKEN, threaded=False)
+# Задержка и ошибки вызовов Bot API по методам (см. metrics.py)
+metrics.instrument_api(telebot.apihelper, "_make_request", 1)
+# Все исходящие сообщения идут через ограничитель скорости Telegram API
+outbox = Outbox(
+    bot,
+    global_rate=getattr(config, "OUTBOX_GLOBAL_RATE", 30),
+    chat_rate=getattr(config, "OUTBOX_CHAT_RATE", 1),
+    chat_burst=getattr(config, "OUTBOX_CHAT_BURST", 3)
+)
+
+# Глобальные словари для хранения состояния
+# Состояние чатов хранится в памяти и с задержкой сохраняется в chat_sessions (см. sessions.py)
+main_messages = sessions.WriteBehindMap("main_message_id")   # chat_id -> message_id основного сообщения
+# Все активные таймеры обслуживаются одним планировщиком (chat_id -> периодическое обновление)
+TIMER_INTERVAL = 10
+timer_scheduler = TickScheduler(interval=TIMER_INTERVAL, workers=getattr(config, "TIMER_WORKERS", 4), name="timer")
+# Графики рисуются в отдельных процессах, обработчики их не ждут
+chart_renderer = charts.ChartRenderer(
+    workers=getattr(config, "CHART_WORKERS", 1),
+    max_pending=getattr(config, "CHART_QUEUE_SIZE", 8),
+    timeout=getattr(config, "CHART_TIMEOUT", 20)
+)
+user_states = sessions.json_map("user_state")                 # chat_id -> dict с состоянием ввода (например, "adding_category", "editing_category", "adding_task")
+
+# ==========================
+# Работа с базой данных (SQLite)
+# ==========================
+def init_db():
+    version = migrations.migrate(db.get_connection())
+    logger.info("Database initialized (schema version %s).", version)
+    logger.info("Loaded %s main messages and %s input states", main_messages.load(), user_states.load())
+    sessions.start_flusher((main_messages, user_states), getattr(config, "SESSION_FLUSH_INTERVAL", sessions.FLUSH_INTERVAL))
+
+# ==========================
+# Функции отправки/редактирования сообщений
+# ==========================
+# Обработчики не ждут лимитов Telegram: правки и новые сообщения уходят через очередь outbox.
+# Пока новое основное сообщение отправляется, его message_id ещё неизвестен — следующий текст
+# для чата запоминается и правит сообщение сразу после отправки.
+main_lock = threading.Lock()
+sending_main = {}                                             # chat_id -> последний текст для отправляемого сообщения
+
+def send_main_menu(chat_id):
+    send_text(chat_id, views.MAIN_MENU_TEXT, reply_markup=views.get_main_keyboard())
+    logger.info("Sent main menu to chat_id %s", chat_id)
+
+def send_text(chat_id, text, reply_markup=None):
+    with main_lock:
+        message_id = main_messages.get(chat_id)
+        if message_id is None:
+            if chat_id in sending_main:
+                sending_main[chat_id] = (text, reply_markup)
+                return
+            sending_main[chat_id] = None
+    if message_id is not None:
+        outbox.edit(chat_id, message_id, text, reply_markup=reply_markup)
+        return
+    outbox.send(chat_id, bot.send_message, chat_id, text, reply_markup=reply_markup,
+                callback=lambda msg: main_message_sent(chat_id, msg))
+
+def main_message_sent(chat_id, msg):
+    """Новое основное сообщение отправлено (msg is None — не отправлено)."""
+    with main_lock:
+        latest = sending_main.pop(chat_id, None)
+        if msg is not None:
+            main_messages[chat_id] = msg.message_id
+    if latest is None:
+        return
+    if msg is None:
+        send_text(chat_id, *latest)
+    else:
+        outbox.edit(chat_id, msg.message_id, *latest)
+
+def delete_message(chat_id, message_id):
+    # Ошибки удаления пишет в лог сам outbox
+    outbox.send(chat_id, bot.delete_message, chat_id, message_id)
+
+def drop_main_message(chat_id):
+    with main_lock:
+        message_id = main_messages.pop(chat_id, None)
+    if message_id is not None:
+        outbox.forget(chat_id, message_id)
+
+def replace_lost_message(chat_id, message_id, text, reply_markup):
+    """Пользователь удалил сообщение (или оно устарело): текст правки уходит новым сообщением."""
+    with main_lock:
+        if main_messages.get(chat_id) == message_id:
+            main_messages.pop(chat_id, None)
+    send_text(chat_id, text, reply_markup=reply_markup)
+
+outbox.on_lost = replace_lost_message
+
+# ==========================
+# Таймер текущей задачи (общий планировщик)
+# ==========================
+@metrics.timed
+def timer_tick(chat_id, task_id, entry):
+    """Одно обновление сообщения таймера. Возвращает False, если таймер больше не нужен."""
+    info = tracker.get_current_task_info(chat_id)
+    if not info:
+        return False
+    current_task_id, task_name, cat_name, total = info
+    # Если задача изменилась, таймер больше не обновляем
+    if current_task_id != task_id:
+        logger.info("Timer for chat_id %s ended", chat_id)
+        return False
+    text = views.timer_text(task_name, cat_name, total)
+    # Пока шёл запрос, таймер могли отменить (выбрана другая задача): старый текст не должен
+    # лечь поверх подтверждения нового выбора, поэтому правка ставится, только если отмены не было
+    timer_scheduler.run_if_active(entry, edit_timer_message, chat_id, text)
+    return True
+
+def edit_timer_message(chat_id, text):
+    if chat_id in main_messages:
+        # Правки одного сообщения схлопываются в очереди, неизменный текст не отправляется
+        outbox.edit(chat_id, main_messages[chat_id], text)
+
+def schedule_timer(chat_id, task_id, delay=None):
+    timer_scheduler.add(chat_id, lambda entry: timer_tick(chat_id, task_id, entry), delay=delay)
+
+def start_timer(chat_id, task_id):
+    timer_scheduler.cancel(chat_id)  # остановим предыдущий таймер, если есть
+    # Закрытие прежней задачи и запуск новой — одна транзакция
+    tracker.switch_task(chat_id, task_id)
+    schedule_timer(chat_id, task_id)
+    logger.info("Started timer for chat_id %s, task_id %s", chat_id, task_id)
+
+def resume_timers():
+    """После перезапуска возобновляет обновление всех запущенных задач.
+
+    current_task читается одним запросом, а первые срабатывания равномерно разносятся
+    по TIMER_RESUME_SPREAD секундам, чтобы тысячи таймеров не правили сообщения разом.
+    """
+    rows = tracker.load_current_tasks()
+    spread = getattr(config, "TIMER_RESUME_SPREAD", TIMER_INTERVAL)
+    for index, (chat_id, task_id) in enumerate(rows):
+        schedule_timer(chat_id, task_id, delay=spread * (index + 1) / len(rows))
+    logger.info("Resumed %s timers over %s s", len(rows), spread)
+
+def stop_timer(chat_id):
+    timer_scheduler.cancel(chat_id)
+    # Завершаем запись текущей задачи: сохраняем время в журнал и удаляем запись из current_task
+    tracker.stop_task(chat_id)
+    logger.info("Stopped timer for chat_id %s", chat_id)
+
+# ==========================
+# Обработчики команд и callback'ов
+# ==========================
+
+# Команда /start
+@bot.message_handler(commands=['start'])
+@metrics.timed
+def handle_start(message):
+    chat_id = message.chat.id
+    # /start всегда присылает новое меню, даже если прежнее сообщение ещё числится основным
+    drop_main_message(chat_id)
+    send_main_menu(chat_id)
+    delete_message(chat_id, message.message_id)
+
+# При нажатии кнопки главного меню
+@router.callback("menu")
+def handle_menu(call, section):
+    chat_id = call.message.chat.id
+    if section == "categories":
+        show_categories(chat_id)
+    elif section == "current_task":
+        show_current_task(chat_id)
+    elif section == "statistics":
+        show_statistics(chat_id)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+
+@metrics.timed
+def show_categories(chat_id, after=0):
+    text, markup = views.categories_view(chat_id, after)
+    send_text(chat_id, text, reply_markup=markup)
+    logger.info("Displayed categories to chat_id %s", chat_id)
+
+# Следующая/предыдущая страница категорий
+@router.callback("cat_page")
+def handle_categories_page(call, after):
+    show_categories(call.message.chat.id, after)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+
+@router.callback("add_category")
+def handle_add_category(call):
+    chat_id = call.message.chat.id
+    send_text(chat_id, "Введите название категории:")
+    user_states[chat_id] = {"state": "adding_category"}
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("Prompted user %s to add category", chat_id)
+
+@router.state("adding_category")
+def process_add_category(message):
+    chat_id = message.chat.id
+    cat_name = message.text.strip()
+    tracker.add_category(chat_id, cat_name)
+    send_main_menu(chat_id)
+    delete_message(chat_id, message.message_id)
+    user_states.pop(chat_id, None)
+    logger.info("Added new category '%s' for chat_id %s", cat_name, chat_id)
+
+
+# Подменю для выбранной категории: просмотр задач, редактирование, удаление
+@router.callback("manage_cat")
+def handle_manage_category(call, cat_id):
+    chat_id = call.message.chat.id
+    text, markup = views.category_view(chat_id, cat_id)
+    outbox.edit(chat_id, call.message.message_id, text, reply_markup=markup)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("Displayed management for category %s", cat_id)
+
+# Редактирование категории: запрос нового названия
+@router.callback("edit_cat")
+def handle_edit_category(call, cat_id):
+    chat_id = call.message.chat.id
+    outbox.edit(chat_id, call.message.message_id, "Введите новое название категории:")
+    user_states[chat_id] = {"state": "editing_category", "category_id": cat_id}
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+
+@router.state("editing_category")
+def process_edit_category(message):
+    chat_id = message.chat.id
+    new_name = message.text.strip()
+    cat_id = user_states[chat_id]["category_id"]
+    if tracker.rename_category(chat_id, cat_id, new_name):
+        send_main_menu(chat_id)
+        logger.info("Edited category %s for chat_id %s", cat_id, chat_id)
+    else:
+        send_text(chat_id, views.CATEGORY_NOT_FOUND_TEXT, reply_markup=views.get_back_keyboard())
+    delete_message(chat_id, message.message_id)
+    user_states.pop(chat_id, None)
+
+# Удаление категории
+@router.callback("delete_cat")
+def handle_delete_category(call, cat_id):
+    chat_id = call.message.chat.id
+    if not tracker.delete_category(chat_id, cat_id):
+        try:
+            bot.answer_callback_query(call.id, "Категория не найдена")
+        except Exception as e:
+            logger.exception("Error answering callback: %s", e)
+        return
+    send_main_menu(chat_id)
+    try:
+        bot.answer_callback_query(call.id, "Категория удалена")
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("Deleted category %s", cat_id)
+
+# Просмотр задач в категории (after — курсор страницы)
+@router.callback("view_tasks")
+def handle_view_tasks(call, cat_id, after=0):
+    chat_id = call.message.chat.id
+    text, markup = views.tasks_view(chat_id, cat_id, after)
+    send_text(chat_id, text, reply_markup=markup)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("Displayed tasks for category %s to chat_id %s", cat_id, chat_id)
+
+# Выбор задачи (запуск таймера)
+@router.callback("select_task")
+def handle_select_task(call, task_id):
+    chat_id = call.message.chat.id
+    if not tracker.owns_task(chat_id, task_id):
+        try:
+            bot.answer_callback_query(call.id, "Задача не найдена")
+        except Exception as e:
+            logger.exception("Error answering callback: %s", e)
+        return
+    start_timer(chat_id, task_id)
+    text, markup = views.task_selected_view(task_id)
+    send_text(chat_id, text, reply_markup=markup)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("Selected task %s for chat_id %s", task_id, chat_id)
+
+# Команда /switch ID: переключение на задачу без меню
+@bot.message_handler(commands=['switch'])
+@metrics.timed
+def handle_switch_command(message):
+    chat_id = message.chat.id
+    task_id = views.switch_target(message)
+    if task_id is None:
+        send_text(chat_id, views.SWITCH_USAGE_TEXT, reply_markup=views.get_back_keyboard())
+    else:
+        start_timer(chat_id, task_id)
+        text, markup = views.task_selected_view(task_id)
+        send_text(chat_id, text, reply_markup=markup)
+        logger.info("Switched chat_id %s to task %s", chat_id, task_id)
+    delete_message(chat_id, message.message_id)
+
+# Добавление задачи: запрос названия задачи
+@router.callback("add_task")
+def handle_add_task(call, cat_id):
+    chat_id = call.message.chat.id
+    send_text(chat_id, "Введите название задачи:")
+    user_states[chat_id] = {"state": "adding_task", "category_id": cat_id}
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("Prompted user %s to add task in category %s", chat_id, cat_id)
+
+@router.state("adding_task")
+def process_add_task(message):
+    chat_id = message.chat.id
+    task_name = message.text.strip()
+    cat_id = user_states[chat_id].get("category_id")
+    if tracker.add_task(chat_id, cat_id, task_name):
+        send_main_menu(chat_id)
+        logger.info("Added new task '%s' in category %s for chat_id %s", task_name, cat_id, chat_id)
+    else:
+        send_text(chat_id, views.CATEGORY_NOT_FOUND_TEXT, reply_markup=views.get_back_keyboard())
+    delete_message(chat_id, message.message_id)
+    user_states.pop(chat_id, None)
+
+@metrics.timed
+def show_current_task(chat_id):
+    text, markup = views.current_task_view(chat_id)
+    send_text(chat_id, text, reply_markup=markup)
+    logger.info("Displayed current task for chat_id %s", chat_id)
+
+def send_chart(chat_id, png):
+    try:
+        outbox.call(chat_id, bot.send_photo, chat_id, photo=png)
+    except Exception as e:
+        logger.exception("Error sending chart: %s", e)
+
+# Отображение статистики: если нет данных – график не генерируется
+@metrics.timed
+def show_statistics(chat_id):
+    text, markup, data = views.statistics_view(chat_id)
+    send_text(chat_id, text, reply_markup=markup)
+    # Текст отвечаем сразу, график догонит его, когда будет готов
+    if charts.has_chart(data) and not chart_renderer.submit(data, lambda png: send_chart(chat_id, png)):
+        logger.warning("Chart for chat_id %s skipped: render queue is full", chat_id)
+    logger.info("Displayed statistics for chat_id %s", chat_id)
+
+# Статистика за период (сегодня / неделя / месяц / произвольные даты)
+@metrics.timed
+def show_range_statistics(chat_id, range_text):
+    text, markup = views.range_statistics_view(chat_id, range_text)
+    send_text(chat_id, text, reply_markup=markup)
+    logger.info("Displayed %s statistics to chat_id %s", range_text, chat_id)
+
+@router.callback("stats")
+def handle_stats_range(call, period):
+    chat_id = call.message.chat.id
+    show_range_statistics(chat_id, period)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+
+# Команда /stats <период>
+@bot.message_handler(commands=['stats'])
+@metrics.timed
+def handle_stats_command(message):
+    chat_id = message.chat.id
+    show_range_statistics(chat_id, views.command_argument(message, "today"))
+    delete_message(chat_id, message.message_id)
+
+# ==========================
+# Экспорт и импорт данных
+# ==========================
+# Выгрузка и загрузка могут идти секундами, поэтому выполняются в своём пуле, а не в полосе чата
+transfer_executor = ThreadPoolExecutor(max_workers=getattr(config, "TRANSFER_WORKERS", 1), thread_name_prefix="transfer")
+
+@metrics.timed
+def run_export(chat_id, fmt, kind):
+    try:
+        file, name, rows = transfer.write_export(chat_id, fmt, kind)
+    except Exception as e:
+        logger.exception("Error exporting data for chat_id %s: %s", chat_id, e)
+        send_text(chat_id, views.EXPORT_FAILED_TEXT, reply_markup=views.get_back_keyboard())
+        return
+    with file:
+        size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        if size > transfer.MAX_DOCUMENT_SIZE:
+            send_text(chat_id, views.EXPORT_TOO_LARGE_TEXT, reply_markup=views.get_back_keyboard())
+            return
+        try:
+            outbox.call(chat_id, bot.send_document, chat_id, file,
+                        visible_file_name=name, caption=views.export_caption(rows))
+        except Exception as e:
+            logger.exception("Error sending export: %s", e)
+
+# Команда /export [csv|jsonl] [entries|totals]
+@bot.message_handler(commands=['export'])
+@metrics.timed
+def handle_export_command(message):
+    chat_id = message.chat.id
+    options = transfer.parse_export_args(views.command_argument(message))
+    if options is None:
+        send_text(chat_id, views.EXPORT_USAGE_TEXT, reply_markup=views.get_back_keyboard())
+    else:
+        send_text(chat_id, views.EXPORT_STARTED_TEXT, reply_markup=views.get_back_keyboard())
+        transfer_executor.submit(run_export, chat_id, *options)
+    delete_message(chat_id, message.message_id)
+
+@metrics.timed
+def run_import(chat_id, document):
+    try:
+        data = bot.download_file(bot.get_file(document.file_id).file_path)
+        summary = transfer.import_file(chat_id, io.BytesIO(data), document.file_name)
+    except ValueError as e:
+        text = f"{views.IMPORT_FAILED_TEXT}: {e}."
+    except Exception as e:
+        logger.exception("Error importing data for chat_id %s: %s", chat_id, e)
+        text = f"{views.IMPORT_FAILED_TEXT}."
+    else:
+        text = views.import_report_text(summary)
+    send_text(chat_id, text, reply_markup=views.get_back_keyboard())
+
+# Команда /import: следующий присланный документ будет импортирован
+@bot.message_handler(commands=['import'])
+@metrics.timed
+def handle_import_command(message):
+    chat_id = message.chat.id
+    user_states[chat_id] = {"state": "importing"}
+    send_text(chat_id, views.IMPORT_PROMPT_TEXT, reply_markup=views.get_back_keyboard())
+    delete_message(chat_id, message.message_id)
+
+# Документ после /import или с подписью /import
+@bot.message_handler(content_types=['document'],
+                     func=lambda message: (message.caption or "").startswith("/import")
+                     or user_states.get(message.chat.id, {}).get("state") == "importing")
+@metrics.timed
+def handle_import_document(message):
+    chat_id = message.chat.id
+    user_states.pop(chat_id, None)
+    document = message.document
+    if (document.file_size or 0) > transfer.MAX_DOWNLOAD_SIZE:
+        send_text(chat_id, views.IMPORT_TOO_LARGE_TEXT, reply_markup=views.get_back_keyboard())
+    else:
+        send_text(chat_id, views.IMPORT_STARTED_TEXT)
+        transfer_executor.submit(run_import, chat_id, document)
+    delete_message(chat_id, message.message_id)
+
+# Обработка кнопки "Назад" для возврата в главное меню
+@router.callback("back_main")
+def handle_back(call):
+    chat_id = call.message.chat.id
+    send_main_menu(chat_id)
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.exception("Error answering callback: %s", e)
+    logger.info("User returned to main menu chat_id %s", chat_id)
+
+# Единые точки входа: callback'и и ввод в состояниях разбираются роутером один раз
+@bot.callback_query_handler(func=lambda call: True)
+def dispatch_callback(call):
+    if not router.dispatch_callback(call):
+        try:
+            bot.answer_callback_query(call.id)
+        except Exception as e:
+            logger.exception("Error answering callback: %s", e)
+
+@bot.message_handler(func=lambda message: router.has_state(user_states.get(message.chat.id, {}).get("state")))
+def dispatch_state_message(message):
+    router.dispatch_message(message, user_states[message.chat.id]["state"])
+
+# # Глобальный обработчик callback для логирования
+# @bot.callback_query_handler(func=lambda call: True)
+# def log_all_callbacks(call):
+#     logger.info("Global callback received: %s", call.data)
+#     try:
+#         bot.answer_callback_query(call.id)
+#     except Exception as e:
+#         logger.exception("Error answering callback: %s", e)
+
+# ==========================
+# Полосы обработки обновлений
+# ==========================
+# Обновления одного чата обрабатываются по порядку в своей полосе, разные чаты — параллельно
+process_update = bot.process_new_updates
+
+def drop_update(update, reason):
+    logger.warning("Dropped update %s for chat_id %s (%s)", update.update_id, update_chat_id(update), reason)
+    if update.callback_query is not None:
+        # Отброшенное нажатие всё равно нужно подтвердить, иначе у клиента крутится индикатор
+        text = "Бот занят, попробуйте ещё раз" if reason == DROP_FULL else None
+        try:
+            bot.answer_callback_query(update.callback_query.id, text)
+        except Exception as e:
+            logger.exception("Error answering dropped callback: %s", e)
+
+update_lanes = UpdateLanes(
+    lambda update: process_update([update]),
+    workers=getattr(config, "UPDATE_WORKERS", 4),
+    max_depth=getattr(config, "UPDATE_QUEUE_SIZE", 100),
+    on_drop=drop_update,
+    name="updates"
+)
+
+def enqueue_updates(updates):
+    for update in updates:
+        # Смещение опроса сдвигается сразу, не дожидаясь обработки
+        if update.update_id > bot.last_update_id:
+            bot.last_update_id = update.update_id
+        chat_id = update_chat_id(update)
+        update_lanes.submit(update.update_id if chat_id is None else chat_id, update, update_merge_key(update))
+
+bot.process_new_updates = enqueue_updates
+
+# ==========================
+# Статистика и остановка
+# ==========================
+def runtime_stats():
+    """Сводка внутренних счётчиков: база, кеш, исходящая очередь, полосы, таймеры, графики."""
+    return {
+        "db": db.stats(),
+        "metadata_cache": tracker.metadata_cache.stats(),
+        "outbox": outbox.stats(),
+        "lanes": update_lanes.stats(),
+        "timers": len(timer_scheduler),
+        "charts": chart_renderer.stats(),
+    }
+
+def register_metrics():
+    """Метрики очередей и счётчики компонентов на /metrics (METRICS_PORT = None отключает)."""
+    metrics.REGISTRY.gauge("bot_active_timers", "Timers currently scheduled", lambda: len(timer_scheduler))
+    metrics.REGISTRY.gauge("bot_lane_depth", "Updates waiting per lane",
+                           lambda: {(str(i),): depth for i, depth in enumerate(update_lanes.depths())}, ("lane",))
+    metrics.REGISTRY.gauge("bot_outbox_queue_depth", "Outgoing API calls waiting for a rate-limit slot",
+                           lambda: outbox.stats()["queue_depth"])
+    metrics.REGISTRY.gauge("bot_chart_pending", "Chart renders in flight", lambda: chart_renderer.pending)
+    metrics.register_stats(runtime_stats)
+    port = getattr(config, "METRICS_PORT", metrics.METRICS_PORT)
+    if port is not None:
+        metrics.start_server(getattr(config, "METRICS_HOST", metrics.METRICS_HOST), port)
+
+def shutdown(signum=None, frame=None):
+    """Остановка по SIGTERM: сохраняет состояние чатов и пишет итоговую статистику в лог."""
+    main_messages.flush()
+    user_states.flush()
+    logger.info("Final stats: %s", json.dumps(runtime_stats()))
+    logging.shutdown()
+    os._exit(0)
+
+def start_background():
+    signal.signal(signal.SIGTERM, shutdown)
+    init_db()
+    register_metrics()
+    resume_timers()
+    # Тяжёлые зависимости графиков загружаются лениво; после старта опроса
+    # их можно заранее прогреть в фоне (CHART_PREWARM_DELAY = None отключает)
+    prewarm_delay = getattr(config, "CHART_PREWARM_DELAY", 5)
+    if prewarm_delay is not None:
+        prewarm_timer = threading.Timer(prewarm_delay, chart_renderer.prewarm)
+        prewarm_timer.daemon = True
+        prewarm_timer.start()
+
+def run_threaded():
+    start_background()
+    # Пока зарегистрирован webhook (например, после --mode webhook), getUpdates отвечает 409
+    try:
+        bot.delete_webhook()
+    except Exception as e:
+        logger.exception("Error deleting webhook: %s", e)
+    logger.info("Starting bot polling...")
+    bot.polling(none_stop=True)
+
+def run_webhook():
+    """Приём обновлений через встроенный HTTP-сервер: POST от Telegram сразу уходят в полосы."""
+    start_background()
+    server = webhook.create_server(lambda update: enqueue_updates([telebot.types.Update.de_json(update)]))
+    webhook.register(bot)
+    logger.info("Starting webhook server on %s:%s", *server.server_address[:2])
+    server.serve_forever()
+
+def main(mode="polling"):
+    if mode == "webhook":
+        run_webhook()
+    else:
+        run_threaded()
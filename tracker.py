@@ -0,0 +1,197 @@
+import logging
+import time
+
+import config
+import db
+import stats
+from cache import MetadataCache
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Операции с данными трекера
+# ==========================
+# Синхронные функции работы с базой и кешем метаданных. Их вызывают оба движка:
+# потоковый (threaded_bot.py) напрямую, асинхронный (async_bot.py) — через пул потоков БД.
+
+# Названия категорий/задач и текущие задачи чатов читаются через кеш
+metadata_cache = MetadataCache(maxsize=getattr(config, "METADATA_CACHE_SIZE", 10000))
+# Кнопок категорий/задач на одной странице клавиатуры
+PAGE_SIZE = getattr(config, "PAGE_SIZE", 8)
+
+
+def get_current_task_info(chat_id):
+    """(task_id, задача, категория, секунды) запущенной задачи чата или None (данные из кеша)."""
+    current = metadata_cache.current_task(chat_id)
+    if not current:
+        return None
+    task_id, start_time, saved_time = current
+    task = metadata_cache.task(task_id)
+    if not task:
+        return None
+    task_name, cat_id, _ = task
+    cat_name = metadata_cache.category_name(cat_id)
+    if cat_name is None:
+        return None
+    elapsed = int(time.time()) - start_time
+    return task_id, task_name, cat_name, saved_time + elapsed
+
+
+def switch_task(chat_id, task_id):
+    """Переключает чат на задачу одной транзакцией: закрывает запущенный отрезок
+    (журнал, total_time, агрегаты) и запускает новую задачу. Возвращает id прежней задачи или None.
+    """
+    now = int(time.time())
+    with db.transaction() as cursor:
+        cursor.execute("SELECT start_time, saved_time, task_id FROM current_task WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+        if row:
+            start_time, saved_time, previous_id = row
+            stats.record_entry(cursor, chat_id, previous_id, start_time - saved_time, now)
+        # Строка чата перезаписывается на месте, без отдельного DELETE
+        cursor.execute('''
+            INSERT INTO current_task (chat_id, task_id, start_time, saved_time) VALUES (?, ?, ?, 0)
+            ON CONFLICT(chat_id) DO UPDATE SET task_id = excluded.task_id, start_time = excluded.start_time, saved_time = 0
+        ''', (chat_id, task_id, now))
+    metadata_cache.invalidate_current(chat_id)
+    return row[2] if row else None
+
+
+def stop_task(chat_id):
+    """Записывает время текущей задачи чата в журнал и удаляет её из current_task."""
+    with db.transaction() as cursor:
+        cursor.execute("SELECT start_time, saved_time, task_id FROM current_task WHERE chat_id = ?", (chat_id,))
+        row = cursor.fetchone()
+        if row:
+            start_time, saved_time, task_id = row
+            stats.record_entry(cursor, chat_id, task_id, start_time - saved_time, int(time.time()))
+            cursor.execute("DELETE FROM current_task WHERE chat_id = ?", (chat_id,))
+    metadata_cache.invalidate_current(chat_id)
+    return row is not None
+
+
+def load_current_tasks():
+    """[(chat_id, task_id), ...] всех запущенных задач одним запросом; заодно прогревает кеш."""
+    with db.read() as cursor:
+        cursor.execute("SELECT chat_id, task_id, start_time, saved_time FROM current_task")
+        rows = cursor.fetchall()
+    metadata_cache.prime_current(rows)
+    return [(chat_id, task_id) for chat_id, task_id, _, _ in rows]
+
+
+def owns_task(chat_id, task_id):
+    task = metadata_cache.task(task_id)
+    return task is not None and task[2] == chat_id
+
+
+def add_category(chat_id, name):
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO categories (name, chat_id) VALUES (?, ?)", (name, chat_id))
+    metadata_cache.invalidate_category(cursor.lastrowid)
+
+
+def rename_category(chat_id, cat_id, name):
+    """Переименовывает категорию чата. False, если такой категории у чата нет."""
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE categories SET name = ? WHERE id = ? AND chat_id = ?", (name, cat_id, chat_id))
+        renamed = cursor.rowcount > 0
+    if renamed:
+        metadata_cache.invalidate_category(cat_id)
+    return renamed
+
+
+def delete_category(chat_id, cat_id):
+    """Удаляет категорию чата. False, если такой категории у чата нет."""
+    with db.transaction() as cursor:
+        # Задачи категории (и ссылающийся на них current_task) удаляются каскадно
+        cursor.execute("DELETE FROM categories WHERE id = ? AND chat_id = ?", (cat_id, chat_id))
+        deleted = cursor.rowcount > 0
+    if deleted:
+        # Каскад затрагивает задачи и текущие задачи многих чатов — сбрасываем кеш целиком
+        metadata_cache.clear()
+    return deleted
+
+
+def add_task(chat_id, cat_id, name):
+    """Добавляет задачу в категорию чата. False, если такой категории у чата нет."""
+    with db.transaction() as cursor:
+        cursor.execute(
+            "INSERT INTO tasks (category_id, name, chat_id) SELECT id, ?, chat_id FROM categories WHERE id = ? AND chat_id = ?",
+            (name, cat_id, chat_id)
+        )
+        added = cursor.rowcount > 0
+    if added:
+        metadata_cache.invalidate_task(cursor.lastrowid)
+    return added
+
+
+# Категории без владельца остаются после обновления схемы, если не был известен ни один чат
+# (см. migrations.add_owner_chat_id). Их получает первый чат, открывший категории или статистику.
+_unowned_checked = False
+
+
+def claim_unowned(chat_id):
+    """Отдаёт чату категории без владельца (с задачами). Возвращает число категорий."""
+    global _unowned_checked
+    if _unowned_checked:
+        return 0
+    with db.transaction() as cursor:
+        cursor.execute("UPDATE categories SET chat_id = ? WHERE chat_id IS NULL", (chat_id,))
+        claimed = cursor.rowcount
+        if claimed:
+            cursor.execute('''
+                UPDATE tasks SET chat_id = ?
+                WHERE chat_id IS NULL AND category_id IN (SELECT id FROM categories WHERE chat_id = ?)
+            ''', (chat_id, chat_id))
+    _unowned_checked = True
+    if claimed:
+        metadata_cache.clear()
+        logger.info("Chat_id %s claimed %s categories left without an owner", chat_id, claimed)
+    return claimed
+
+
+# ==========================
+# Постраничные списки (keyset)
+# ==========================
+# Страница задаётся курсором after — id последней строки предыдущей страницы — и читается
+# по составному индексу (chat_id[, category_id], id): стоимость экрана не зависит от того,
+# сколько всего строк в таблице и на какой странице пользователь.
+def _keyset_page(cursor, source, params, after, limit):
+    """(строки [(id, название)], курсор предыдущей страницы или None, курсор следующей или None)."""
+    cursor.execute(f"SELECT id, name FROM {source} AND id > ? ORDER BY id LIMIT ?", (*params, after, limit + 1))
+    rows = cursor.fetchall()
+    next_after = rows[limit - 1][0] if len(rows) > limit else None
+    prev_after = None
+    if after:
+        # Предыдущая страница — limit строк с id <= after; её курсор — id строки перед ними (или 0)
+        cursor.execute(f"SELECT id FROM {source} AND id <= ? ORDER BY id DESC LIMIT 1 OFFSET ?", (*params, after, limit))
+        row = cursor.fetchone()
+        prev_after = row[0] if row else 0
+    return rows[:limit], prev_after, next_after
+
+
+def category_page(chat_id, after=0, limit=PAGE_SIZE):
+    claim_unowned(chat_id)
+    with db.read() as cursor:
+        return _keyset_page(cursor, "categories WHERE chat_id = ?", (chat_id,), after, limit)
+
+
+def task_page(chat_id, cat_id, after=0, limit=PAGE_SIZE):
+    with db.read() as cursor:
+        return _keyset_page(cursor, "tasks WHERE chat_id = ? AND category_id = ?", (chat_id, cat_id), after, limit)
+
+
+def category_totals(chat_id):
+    claim_unowned(chat_id)
+    with db.read() as cursor:
+        return stats.category_totals(cursor, chat_id)
+
+
+def range_totals(chat_id, first_day, last_day):
+    """{категория: {задача: секунды}} за период, включая время запущенной задачи."""
+    claim_unowned(chat_id)
+    with db.read() as cursor:
+        return stats.merge_totals(
+            stats.range_totals(cursor, chat_id, first_day, last_day),
+            stats.inflight_totals(cursor, chat_id, first_day, last_day)
+        )
@@ -0,0 +1,342 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+import config
+import db
+import stats
+import tracker
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Экспорт и импорт учтённого времени
+# ==========================
+# /export выгружает данные чата потоком: курсор SQLite отдаёт строки по одной, генератор
+# кодирует их в CSV или JSON Lines и пишет во временный файл, поэтому память не растёт
+# с объёмом истории. /import читает файл построчно, проверяет каждую строку и вставляет
+# их пачками через executemany — по транзакции на пачку; агрегаты статистики
+# обновляются одним UPSERT на задачу, категорию и день пачки, а не на каждую строку.
+FORMATS = ("csv", "jsonl")
+KINDS = ("entries", "totals")
+ENTRY_FIELDS = ("category", "task", "start", "end", "seconds")
+TOTAL_FIELDS = ("category", "task", "seconds")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CHUNK_ROWS = 1000
+BATCH_SIZE = getattr(config, "IMPORT_BATCH_SIZE", 5000)
+# Выгрузка больше этого размера сжимается в .gz
+COMPRESS_ABOVE = getattr(config, "EXPORT_COMPRESS_ABOVE", 5 * 1024 * 1024)
+# Ограничения Bot API: бот отправляет документы до 50 МБ и скачивает до 20 МБ
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+MAX_NAME_LENGTH = 255
+MAX_REPORTED_ERRORS = 5
+# Пределы импорта: 20 МБ .gz разворачиваются в сколько угодно строк, а один отрезок
+# в десятки лет даёт по строке daily_rollup на каждый день
+MAX_IMPORT_ROWS = getattr(config, "IMPORT_MAX_ROWS", 1_000_000)
+MAX_LINE_LENGTH = 64 * 1024
+MAX_ENTRY_SECONDS = getattr(config, "IMPORT_MAX_ENTRY_SECONDS", 7 * 86400)
+MAX_TOTAL_SECONDS = 10 * 365 * 86400
+MIN_TIMESTAMP = 946684800          # 2000-01-01
+MAX_CLOCK_SKEW = 86400             # время из будущего допускается не дальше суток
+
+
+def parse_export_args(text):
+    """'csv', 'jsonl totals', ... -> (формат, вид или None — выбрать автоматически); None, если не разобрать."""
+    fmt, kind = "csv", None
+    for word in (text or "").lower().split():
+        if word in FORMATS:
+            fmt = word
+        elif word in KINDS:
+            kind = word
+        else:
+            return None
+    return fmt, kind
+
+
+def format_timestamp(timestamp):
+    return time.strftime(TIME_FORMAT, time.localtime(timestamp))
+
+
+def parse_timestamp(value):
+    """Unix-время (число) или локальное 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' / ISO 8601 -> int."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except ValueError:
+            pass
+    raise ValueError(f"некорректное время {value!r}")
+
+
+# ==========================
+# Экспорт
+# ==========================
+def has_entries(chat_id):
+    with db.read() as cursor:
+        cursor.execute("SELECT 1 FROM time_entries WHERE chat_id = ? LIMIT 1", (chat_id,))
+        return cursor.fetchone() is not None
+
+
+def export_rows(chat_id, kind):
+    """Генератор строк выгрузки в порядке ENTRY_FIELDS (журнал) или TOTAL_FIELDS (итоги по задачам)."""
+    with db.read() as cursor:
+        if kind == "entries":
+            cursor.execute('''
+                SELECT c.name, t.name, te.start, te.end
+                FROM time_entries te
+                JOIN tasks t ON t.id = te.task_id
+                JOIN categories c ON c.id = t.category_id
+                WHERE te.chat_id = ?
+                ORDER BY te.start
+            ''', (chat_id,))
+            for cat_name, task_name, start, end in cursor:
+                yield cat_name, task_name, format_timestamp(start), format_timestamp(end), end - start
+        else:
+            # Категории без задач тоже выгружаются — с пустой задачей
+            cursor.execute('''
+                SELECT c.name, COALESCE(t.name, ''), COALESCE(t.total_time, 0)
+                FROM categories c
+                LEFT JOIN tasks t ON t.category_id = c.id
+                WHERE c.chat_id = ?
+                ORDER BY c.id, t.id
+            ''', (chat_id,))
+            yield from cursor
+
+
+def encode(rows, fields, fmt):
+    """Генератор текста CSV (с заголовком) или JSON Lines, кусками по CHUNK_ROWS строк."""
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(fields)
+        for number, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if number % CHUNK_ROWS == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+        return
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+        if len(chunk) == CHUNK_ROWS:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+def write_export(chat_id, fmt="csv", kind=None):
+    """Пишет выгрузку чата во временный файл: (файл в начале, имя документа, число строк).
+
+    kind=None выбирает журнал, если он есть, иначе итоги. Файл закрывает вызывающий.
+    """
+    if kind is None:
+        kind = "entries" if has_entries(chat_id) else "totals"
+    fields = ENTRY_FIELDS if kind == "entries" else TOTAL_FIELDS
+    name = f"timetracker_{kind}.{fmt}"
+    counter = {"rows": 0}
+
+    def counted(rows):
+        for row in rows:
+            counter["rows"] += 1
+            yield row
+
+    out = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    for chunk in encode(counted(export_rows(chat_id, kind)), fields, fmt):
+        text.write(chunk)
+    text.flush()
+    text.detach()
+    if out.tell() > COMPRESS_ABOVE:
+        out.seek(0)
+        packed = tempfile.TemporaryFile()
+        with gzip.GzipFile(filename=name, mode="wb", fileobj=packed) as archive:
+            shutil.copyfileobj(out, archive)
+        out.close()
+        out, name = packed, name + ".gz"
+    out.seek(0)
+    logger.info("Exported %s %s rows for chat_id %s (%s)", counter["rows"], kind, chat_id, name)
+    return out, name, counter["rows"]
+
+
+# ==========================
+# Импорт
+# ==========================
+def _lines(text):
+    """Строки файла; слишком длинная строка прерывает импорт, а не читается в память целиком."""
+    for number, line in enumerate(iter(lambda: text.readline(MAX_LINE_LENGTH + 1), ""), 1):
+        if len(line.rstrip("\r\n")) > MAX_LINE_LENGTH:
+            raise ValueError(f"строка {number} длиннее {MAX_LINE_LENGTH} символов")
+        yield line
+
+
+def read_records(fileobj, name):
+    """Генератор (номер строки, dict или None для неразборчивой строки) из .csv / .jsonl, в том числе .gz."""
+    lower = (name or "").lower()
+    if lower.endswith(".gz"):
+        fileobj = gzip.GzipFile(fileobj=fileobj)
+        lower = lower[:-3]
+    if not lower.endswith((".csv", ".jsonl", ".ndjson")):
+        raise ValueError("нужен файл .csv или .jsonl")
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    lines = _lines(text)
+    if lower.endswith(".csv"):
+        reader = csv.DictReader(lines)
+        try:
+            for record in reader:
+                yield reader.line_num, record
+        except csv.Error as e:
+            raise ValueError(f"строка {reader.line_num}: {e}")
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def _name(record, field, required=True):
+    value = record.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f"пустое поле {field}")
+    if len(value) > MAX_NAME_LENGTH:
+        raise ValueError(f"поле {field} длиннее {MAX_NAME_LENGTH} символов")
+    return value
+
+
+def parse_record(record, now=None):
+    """Проверяет строку импорта.
+
+    Строка журнала (есть start): (категория, задача, start, end).
+    Строка итогов: (категория, задача или '', None, секунды).
+    """
+    if record is None:
+        raise ValueError("не удалось разобрать строку")
+    category = _name(record, "category")
+    if record.get("start") not in (None, ""):
+        task = _name(record, "task")
+        start = parse_timestamp(record["start"])
+        end = parse_timestamp(record.get("end"))
+        latest = (time.time() if now is None else now) + MAX_CLOCK_SKEW
+        if not MIN_TIMESTAMP <= start <= latest or not MIN_TIMESTAMP <= end <= latest:
+            raise ValueError("время вне допустимого диапазона")
+        if end < start:
+            raise ValueError("end раньше start")
+        if end - start > MAX_ENTRY_SECONDS:
+            raise ValueError(f"отрезок длиннее {MAX_ENTRY_SECONDS // 3600} ч")
+        return category, task, start, end
+    task = _name(record, "task", required=False)
+    try:
+        seconds = int(record.get("seconds") or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"некорректное число секунд {record.get('seconds')!r}")
+    if not 0 <= seconds <= MAX_TOTAL_SECONDS:
+        raise ValueError("число секунд вне допустимого диапазона")
+    return category, task, None, seconds
+
+
+class _Names:
+    """id категорий и задач чата по названиям; недостающие создаются в текущей транзакции."""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.created = {"categories": 0, "tasks": 0}
+        with db.read() as cursor:
+            cursor.execute("SELECT name, id FROM categories WHERE chat_id = ? ORDER BY id DESC", (self.chat_id,))
+            self.categories = dict(cursor.fetchall())
+            cursor.execute("SELECT category_id, name, id FROM tasks WHERE chat_id = ? ORDER BY id DESC", (self.chat_id,))
+            self.tasks = {(cat_id, name): task_id for cat_id, name, task_id in cursor}
+
+    def category(self, cursor, name):
+        cat_id = self.categories.get(name)
+        if cat_id is None:
+            cursor.execute("INSERT INTO categories (name, chat_id) VALUES (?, ?)", (name, self.chat_id))
+            cat_id = self.categories[name] = cursor.lastrowid
+            self.created["categories"] += 1
+        return cat_id
+
+    def task(self, cursor, cat_id, name):
+        task_id = self.tasks.get((cat_id, name))
+        if task_id is None:
+            cursor.execute("INSERT INTO tasks (category_id, name, chat_id) VALUES (?, ?, ?)", (cat_id, name, self.chat_id))
+            task_id = self.tasks[(cat_id, name)] = cursor.lastrowid
+            self.created["tasks"] += 1
+        return task_id
+
+
+def _insert_batch(chat_id, names, batch):
+    entries = []
+    task_time = {}
+    category_time = {}
+    with db.transaction() as cursor:
+        for category, task, start, value in batch:
+            cat_id = names.category(cursor, category)
+            task_id = names.task(cursor, cat_id, task) if task else None
+            if start is not None:
+                entries.append((task_id, cat_id, start, value))
+            elif value:
+                if task_id is not None:
+                    task_time[task_id] = task_time.get(task_id, 0) + value
+                category_time[cat_id] = category_time.get(cat_id, 0) + value
+        stats.record_entries(cursor, chat_id, entries)
+        stats.add_totals(cursor, task_time, category_time)
+    return len(entries)
+
+
+def import_file(chat_id, fileobj, name, batch_size=BATCH_SIZE, max_rows=MAX_IMPORT_ROWS):
+    """Импортирует файл в данные чата.
+
+    Возвращает сводку: rows, imported, entries, invalid, errors, truncated, categories, tasks (созданные).
+
+    Неверные строки пропускаются (первые MAX_REPORTED_ERRORS описаний — в errors).
+    Читается не больше max_rows строк, остальные отбрасываются (truncated=True).
+    Если запись пачки не удалась, импорт прерывается; уже записанные пачки остаются.
+    """
+    names = _Names(chat_id)
+    summary = {"rows": 0, "imported": 0, "entries": 0, "invalid": 0, "errors": [], "truncated": False}
+    batch = []
+    now = time.time()
+    try:
+        for number, record in read_records(fileobj, name):
+            if summary["rows"] >= max_rows:
+                summary["truncated"] = True
+                break
+            summary["rows"] += 1
+            try:
+                batch.append(parse_record(record, now))
+            except ValueError as e:
+                summary["invalid"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append(f"строка {number}: {e}")
+                continue
+            if len(batch) >= batch_size:
+                summary["entries"] += _insert_batch(chat_id, names, batch)
+                summary["imported"] += len(batch)
+                batch = []
+        if batch:
+            summary["entries"] += _insert_batch(chat_id, names, batch)
+            summary["imported"] += len(batch)
+    finally:
+        # Новые категории/задачи и изменившиеся итоги — сбрасываем кеш целиком
+        tracker.metadata_cache.clear()
+    summary.update(names.created)
+    logger.info("Imported %s of %s rows for chat_id %s (%s invalid)",
+                summary["imported"], summary["rows"], chat_id, summary["invalid"])
+    return summary
@@ -0,0 +1,202 @@
+from telebot import types
+
+import stats
+import tracker
+from router import encode
+
+# ==========================
+# Тексты и клавиатуры экранов
+# ==========================
+# Функции возвращают (текст, клавиатура) и не отправляют сообщений сами,
+# поэтому одинаково подходят потоковому и асинхронному движкам.
+
+MAIN_MENU_TEXT = "Главное меню"
+NO_TASK_TEXT = "Нет активной задачи."
+# Категория удалена или принадлежит другому чату (например, ввод после удаления категории)
+CATEGORY_NOT_FOUND_TEXT = "Категория не найдена."
+
+
+def format_time(seconds):
+    """Преобразует секунды в формат ЧЧ:ММ:СС"""
+    h = seconds // 3600
+    m = (seconds % 3600) // 60
+    s = seconds % 60
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
+# Формирование клавиатур
+def get_main_keyboard():
+    markup = types.InlineKeyboardMarkup()
+    btn1 = types.InlineKeyboardButton("Категории", callback_data=encode("menu", "categories"))
+    btn2 = types.InlineKeyboardButton("Текущая задача", callback_data=encode("menu", "current_task"))
+    btn3 = types.InlineKeyboardButton("Статистика", callback_data=encode("menu", "statistics"))
+    markup.row(btn1, btn2)
+    markup.row(btn3)
+    return markup
+
+
+def get_back_keyboard():
+    markup = types.InlineKeyboardMarkup()
+    btn = types.InlineKeyboardButton("Назад", callback_data=encode("back_main"))
+    markup.add(btn)
+    return markup
+
+
+def get_statistics_keyboard():
+    markup = types.InlineKeyboardMarkup()
+    markup.row(
+        types.InlineKeyboardButton("Сегодня", callback_data=encode("stats", "today")),
+        types.InlineKeyboardButton("Неделя", callback_data=encode("stats", "week")),
+        types.InlineKeyboardButton("Месяц", callback_data=encode("stats", "month")),
+    )
+    markup.add(types.InlineKeyboardButton("Назад", callback_data=encode("back_main")))
+    return markup
+
+
+def page_buttons(markup, action, args, prev_after, next_after):
+    """Ряд ◀/▶ для перехода между страницами; callback_data — действие, args и курсор страницы."""
+    buttons = []
+    if prev_after is not None:
+        buttons.append(types.InlineKeyboardButton(text="◀", callback_data=encode(action, *args, prev_after)))
+    if next_after is not None:
+        buttons.append(types.InlineKeyboardButton(text="▶", callback_data=encode(action, *args, next_after)))
+    if buttons:
+        markup.row(*buttons)
+
+
+# Отображение категорий: выводится сообщение "Выберите категорию:" с кнопками, без дублирования текста
+def categories_view(chat_id, after=0):
+    rows, prev_after, next_after = tracker.category_page(chat_id, after)
+    text = "Выберите категорию:"
+    markup = types.InlineKeyboardMarkup()
+    for row in rows:
+        cat_id, name = row
+        # Кнопка ведёт в подменю управления категорией
+        markup.add(types.InlineKeyboardButton(text=name, callback_data=encode("manage_cat", cat_id)))
+    page_buttons(markup, "cat_page", (), prev_after, next_after)
+    markup.add(types.InlineKeyboardButton(text="Добавить категорию", callback_data=encode("add_category")))
+    markup.add(types.InlineKeyboardButton(text="Назад", callback_data=encode("back_main")))
+    return text, markup
+
+
+# Подменю для выбранной категории: просмотр задач, редактирование, удаление
+def category_view(chat_id, cat_id):
+    category = tracker.metadata_cache.category(cat_id)
+    # Чужая категория показывается так же, как несуществующая
+    cat_name = category[0] if category and category[1] == chat_id else "Неизвестно"
+    text = f"Категория: {cat_name}\nВыберите действие:"
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(text="Просмотреть задачи", callback_data=encode("view_tasks", cat_id)))
+    markup.row(
+        types.InlineKeyboardButton(text="Редактировать", callback_data=encode("edit_cat", cat_id)),
+        types.InlineKeyboardButton(text="Удалить", callback_data=encode("delete_cat", cat_id))
+    )
+    markup.add(types.InlineKeyboardButton(text="Назад", callback_data=encode("menu", "categories")))
+    return text, markup
+
+
+# Просмотр задач в категории
+def tasks_view(chat_id, cat_id, after=0):
+    rows, prev_after, next_after = tracker.task_page(chat_id, cat_id, after)
+    text = f"Задачи в категории {cat_id}:"
+    markup = types.InlineKeyboardMarkup()
+    for row in rows:
+        task_id, name = row
+        markup.add(types.InlineKeyboardButton(text=f"Выбрать {name}", callback_data=encode("select_task", task_id)))
+    page_buttons(markup, "view_tasks", (cat_id,), prev_after, next_after)
+    markup.add(types.InlineKeyboardButton(text="Добавить задачу", callback_data=encode("add_task", cat_id)))
+    markup.add(types.InlineKeyboardButton(text="Назад", callback_data=encode("menu", "categories")))
+    return text, markup
+
+
+SWITCH_USAGE_TEXT = "Использование: /switch ID_задачи"
+
+
+def switch_target(message):
+    """id задачи чата из '/switch 42' или None."""
+    arg = command_argument(message).strip()
+    if not arg.isdigit():
+        return None
+    task_id = int(arg)
+    return task_id if tracker.owns_task(message.chat.id, task_id) else None
+
+
+EXPORT_USAGE_TEXT = "Использование: /export [csv | jsonl] [entries | totals]"
+EXPORT_STARTED_TEXT = "Готовлю выгрузку, файл придёт отдельным сообщением."
+EXPORT_FAILED_TEXT = "Не удалось подготовить выгрузку."
+EXPORT_TOO_LARGE_TEXT = "Выгрузка больше 50 МБ — Telegram не примет такой файл. Попробуйте /export totals."
+IMPORT_PROMPT_TEXT = ("Отправьте файл .csv или .jsonl (можно .gz) с колонками "
+                      "category, task, start, end — журнал времени, или category, task, seconds — итоги.")
+IMPORT_STARTED_TEXT = "Импортирую файл…"
+IMPORT_FAILED_TEXT = "Не удалось импортировать файл"
+IMPORT_TOO_LARGE_TEXT = "Файл больше 20 МБ — бот не может его скачать. Сожмите его в .gz."
+
+
+def export_caption(rows):
+    return f"Выгрузка: {rows} строк"
+
+
+def import_report_text(summary):
+    text = (f"Импорт завершён: {summary['imported']} из {summary['rows']} строк, "
+            f"новых категорий {summary['categories']}, задач {summary['tasks']}.")
+    if summary["truncated"]:
+        text += f"\nПрочитаны только первые {summary['rows']} строк, остальные пропущены."
+    if summary["invalid"]:
+        text += f"\nПропущено строк с ошибками: {summary['invalid']}\n" + "\n".join(summary["errors"])
+    return text
+
+
+def task_selected_view(task_id):
+    return f"Выбрана задача с ID {task_id}. Таймер запущен.", get_back_keyboard()
+
+
+def timer_text(task_name, cat_name, total):
+    formatted_time = format_time(total)
+    return f"Текущая задача:\nКатегория: {cat_name}\nЗадача: {task_name}\nВремя: {formatted_time}"
+
+
+# Отображение текущей задачи с названием категории и задачи, а также временем в читаемом виде
+def current_task_view(chat_id):
+    info = tracker.get_current_task_info(chat_id)
+    if info:
+        task_id, task_name, cat_name, total = info
+        text = timer_text(task_name, cat_name, total)
+    else:
+        text = NO_TASK_TEXT
+    return text, get_back_keyboard()
+
+
+# Отображение статистики: возвращает ещё и данные для графика
+def statistics_view(chat_id):
+    rows = tracker.category_totals(chat_id)
+    text = "Статистика по категориям:\n"
+    data = {}
+    for row in rows:
+        cat_name, total_time = row
+        text += f"{cat_name}: {total_time} сек.\n"
+        data[cat_name] = total_time
+    return text, get_statistics_keyboard(), data
+
+
+# Статистика за период: считается по дневным агрегатам плюс время запущенной задачи
+def range_statistics_view(chat_id, range_text):
+    period = stats.parse_range(range_text)
+    markup = get_statistics_keyboard()
+    if period is None:
+        return "Неизвестный период. Используйте: /stats today | week | month | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]", markup
+    label, first_day, last_day = period
+    totals = tracker.range_totals(chat_id, first_day, last_day)
+    text = f"Статистика за {label}:\n"
+    if not totals:
+        text += "Нет данных.\n"
+    for cat_name, tasks in totals.items():
+        text += f"{cat_name}: {format_time(sum(tasks.values()))}\n"
+        for task_name, seconds in tasks.items():
+            text += f"  • {task_name}: {format_time(seconds)}\n"
+    return text, markup
+
+
+def command_argument(message, default=""):
+    """Текст после команды: '/stats week' -> 'week'."""
+    parts = (message.text or "").split(maxsplit=1)
+    return parts[1] if len(parts) > 1 else default
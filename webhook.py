@@ -0,0 +1,138 @@
+import hmac
+import json
+import logging
+import ssl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# Приём обновлений через webhook
+# ==========================
+# Встроенный HTTP-сервер принимает POST от Telegram, проверяет секретный токен
+# (заголовок X-Telegram-Bot-Api-Secret-Token), сразу отвечает 200 и передаёт
+# обновление в on_update — обработка идёт в полосах/цикле событий, а не в потоке запроса.
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1024 * 1024
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", "")
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, path, secret_token, on_update, certfile=None, keyfile=None):
+        super().__init__(address, _WebhookHandler)
+        self.webhook_path = path
+        self.secret_token = secret_token or ""
+        self.on_update = on_update
+        self.received = 0
+        self.rejected = 0
+        if certfile:
+            # Обычно TLS снимает обратный прокси; сертификат нужен только при прямом доступе
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("Webhook %s - %s", self.address_string(), format % args)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _reject(self, status):
+        """Отказ без чтения тела: соединение закрывается, чтобы непрочитанное тело не стало следующим запросом."""
+        self.server.rejected += 1
+        self.close_connection = True
+        self._reply(status)
+
+    def do_POST(self):
+        server = self.server
+        if self.path != server.webhook_path:
+            self._reject(404)
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._reject(411)
+            return
+        # Только десятичное число: int() принял бы и "-1", и " 1_0 "
+        if not length.isdigit():
+            self._reject(400)
+            return
+        length = int(length)
+        if length > MAX_BODY_SIZE:
+            self._reject(413)
+            return
+        body = self.rfile.read(length)
+        token = self.headers.get(SECRET_HEADER) or ""
+        if not hmac.compare_digest(token.encode(), server.secret_token.encode()):
+            server.rejected += 1
+            logger.warning("Webhook request with invalid secret token from %s", self.client_address[0])
+            self._reply(403)
+            return
+        try:
+            update = json.loads(body)
+        except ValueError:
+            server.rejected += 1
+            self._reply(400)
+            return
+        # Отвечаем до обработки: Telegram ждёт 200, а не результат обработчика
+        self._reply(200)
+        server.received += 1
+        try:
+            server.on_update(update)
+        except Exception as e:
+            logger.exception("Error enqueuing webhook update: %s", e)
+
+    def do_GET(self):
+        self._reply(404)
+
+
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def create_server(on_update):
+    """WebhookServer с адресом, путём, секретом и сертификатом из config.
+
+    Без WEBHOOK_SECRET любой, кто достучится до порта, может прислать поддельное обновление
+    от имени любого чата. Поэтому без секрета сервер по умолчанию слушает только 127.0.0.1
+    (за локальным обратным прокси), а внешний WEBHOOK_HOST без секрета не запускается.
+    """
+    host = getattr(config, "WEBHOOK_HOST", None)
+    if not WEBHOOK_SECRET:
+        if host is None:
+            host = "127.0.0.1"
+            logger.warning("WEBHOOK_SECRET is not set: listening on 127.0.0.1 only")
+        elif host not in LOOPBACK_HOSTS:
+            raise RuntimeError(f"WEBHOOK_SECRET is required to accept webhook requests on {host}")
+    return WebhookServer(
+        (host or "0.0.0.0", getattr(config, "WEBHOOK_PORT", 8443)),
+        WEBHOOK_PATH,
+        WEBHOOK_SECRET,
+        on_update,
+        certfile=getattr(config, "WEBHOOK_CERT", None),
+        keyfile=getattr(config, "WEBHOOK_KEY", None)
+    )
+
+
+def registration():
+    """Аргументы set_webhook или None, если WEBHOOK_URL не задан (webhook настроен вручную)."""
+    url = getattr(config, "WEBHOOK_URL", None)
+    if not url:
+        return None
+    return {"url": url.rstrip("/") + WEBHOOK_PATH, "secret_token": WEBHOOK_SECRET or None}
+
+
+def register(bot):
+    kwargs = registration()
+    if kwargs is not None:
+        bot.set_webhook(**kwargs)
+        logger.info("Webhook registered at %s", kwargs["url"])